@@ -4,14 +4,14 @@ from flask_login import LoginManager
 from flask_mail import Mail
 from flask_moment import Moment
 from flask_pagedown import PageDown
-from flask_sqlalchemy import SQLAlchemy
 
 from config import config
+from .replicas import RoutingSQLAlchemy
 import os
 
 bootstrap = Bootstrap()
 mail = Mail()
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 moment = Moment()
 login_manager = LoginManager()
 pagedown = PageDown()
@@ -32,6 +32,30 @@ def create_app():
     login_manager.init_app(app)
     pagedown.init_app(app)
 
+    from .render import render_cache
+    render_cache.maxsize = app.config['MARKDOWN_CACHE_SIZE']
+
+    from .presence import last_seen_buffer
+    last_seen_buffer.init_app(app)
+
+    from .identity import identity_cache
+    identity_cache.ttl = app.config['IDENTITY_CACHE_TTL']
+
+    from .fragments import fragment_cache
+    fragment_cache.init_app(app)
+
+    from .follows import follow_graph
+    follow_graph.init_app(app)
+
+    from .metrics import sql_metrics
+    sql_metrics.init_app(app)
+
+    from .profiler import sampling_profiler
+    sampling_profiler.init_app(app)
+
+    from .replicas import replica_router
+    replica_router.init_app(app)
+
     from .main import main as main_blueprint
     app.register_blueprint(main_blueprint)
 
@@ -1,8 +1,12 @@
 from flask import g, jsonify
 from flask_httpauth import HTTPBasicAuth
 
-from app.api_1_0.errors import forbidden
+from app import db
+from app.api_1_0.batch import requested_ids, get_many
+from app.api_1_0.decorators import conditional
+from app.api_1_0.errors import forbidden, bad_request
 from app.models import AnonymousUser, User
+from app.replicas import read_only
 from . import api
 
 auth = HTTPBasicAuth()
@@ -37,6 +41,8 @@ def auth_error():
 def befor_request():
     if (not g.current_user.is_anonymous) and not g.current_user.confirmed:
         return forbidden("un confirmed account")
+    if not g.current_user.is_anonymous:
+        g.current_user.ping()
 
 
 @api.route('/token')
@@ -46,7 +52,26 @@ def get_token():
     return jsonify(token=g.current_user.generate_auth_token(), expiration=3600 * 24)
 
 
+def user_version(id):
+    row = db.session.query(User.username, User.last_seen, User.posts_count).filter(User.id == id).first()
+    if row is None:
+        return None, None
+    return '%s-%s-%s-%s' % ((id,) + tuple(row)), None
+
+
+@api.route('/users/')
+@read_only
+def get_users():
+    ids = requested_ids()
+    if ids is None:
+        return bad_request('ids 是必须的')
+    users, missing = get_many(User.query, User.id, ids)
+    return jsonify(users=[user.to_json() for user in users], missing=missing)
+
+
 @api.route('/user/<int:id>')
+@read_only
+@conditional(user_version, max_age=60)
 def get_user(id):
     u = User.query.get_or_404(id)
     return jsonify(u.to_json())
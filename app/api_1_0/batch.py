@@ -0,0 +1,39 @@
+from flask import request, current_app
+
+from app.exceptions import ValidationError, MalformedRequest
+
+
+def requested_ids():
+    """The ?ids=1,2,3 of a multi-get, None when the request doesn't have one"""
+    raw = request.args.get('ids')
+    if raw is None:
+        return None
+    try:
+        ids = [int(id) for id in raw.split(',') if id.strip()]
+    except ValueError:
+        raise MalformedRequest('ids 必须是逗号分隔的整数')
+    check_batch_size(ids, MalformedRequest)
+    return ids
+
+
+def check_batch_size(items, error=ValidationError):
+    limit = current_app.config['API_BATCH_LIMIT']
+    if len(items) > limit:
+        raise error('一次最多 %d 个' % limit)
+
+
+def get_many(query, column, ids):
+    """Rows whose column is in ids with one IN query, in the order of ids, and the ids not found"""
+    found = {getattr(item, column.key): item for item in query.filter(column.in_(ids))} if ids else {}
+    return [found[id] for id in ids if id in found], [id for id in ids if id not in found]
+
+
+def json_items():
+    """The list of a bulk create: either the body itself or its 'items' member"""
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('items')
+    if not isinstance(data, list) or not data:
+        raise ValidationError('items 是空的')
+    check_batch_size(data)
+    return data
@@ -1,6 +1,8 @@
+import hashlib
+from datetime import timezone
 from functools import wraps
 
-from flask import g
+from flask import g, request, make_response, current_app
 
 from app.api_1_0.errors import forbidden
 
@@ -16,3 +18,46 @@ def permission_required(permission):
         return decorate_function
 
     return decorator
+
+
+def conditional(validator, max_age=0):
+    """Answer conditional GETs with 304 before the view builds its body.
+
+    validator(*args, **kwargs) must be cheap and return (version, last_modified), version being
+    anything whose str() changes with the content; (None, None) lets the view run (e.g. to 404).
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            version, last_modified = validator(*args, **kwargs)
+            if version is None:
+                return f(*args, **kwargs)
+            etag = hashlib.sha1(('%s|%s' % (request.full_path, version)).encode('utf-8')).hexdigest()
+            if last_modified is not None:
+                last_modified = last_modified.replace(microsecond=0)
+            if not_modified(etag, last_modified):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            response.headers['Cache-Control'] = 'private, max-age=%d, must-revalidate' % max_age
+            return response
+
+        return decorated_function
+
+    return decorator
+
+
+def not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    since = request.if_modified_since
+    if since is None or last_modified is None:
+        return False
+    if since.tzinfo is not None:
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    return last_modified <= since
@@ -1,6 +1,6 @@
 from flask.json import jsonify
 
-from app.exceptions import ValidationError
+from app.exceptions import ValidationError, MalformedRequest, PasswordHasherBusy
 from . import api
 
 
@@ -14,6 +14,26 @@ def bad_request(param):
     return response, 412
 
 
+def malformed_request(message):
+    response = jsonify({"status": 400, "error": message})
+    return response, 400
+
+
+def service_unavailable(message):
+    response = jsonify({"status": 503, "error": message})
+    return response, 503
+
+
 @api.errorhandler(ValidationError)
 def validation_error(e):
     return bad_request(e.args[0])
+
+
+@api.errorhandler(MalformedRequest)
+def malformed_request_error(e):
+    return malformed_request(e.args[0])
+
+
+@api.errorhandler(PasswordHasherBusy)
+def password_hasher_busy(e):
+    return service_unavailable(e.args[0])
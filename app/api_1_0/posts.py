@@ -1,32 +1,102 @@
-from flask import jsonify, request, g, url_for
+from flask import jsonify, request, g, url_for, current_app
 
 from app import db
-from app.api_1_0.decorators import permission_required
+from app.api_1_0.batch import requested_ids, get_many, json_items
+from app.api_1_0.decorators import permission_required, conditional
 from app.api_1_0.errors import forbidden
+from app.api_1_0.streaming import collection
 from app.exceptions import ValidationError
-from app.models import Post, User, Permission, PostType
+from app.loaders import load_authors, load_parents, load_replies
+from app.models import ChangeCounter, Post, User, Permission, PostType, Timeline
+from app.pagination import MergedKeysetPagination, paginate_keyset
+from app.replicas import read_only
 from . import api
 from .authentication import auth
 
 
+def with_parents(query):
+    """Post.to_json of a comment needs its parent; streamed collections read through a server side
+    cursor, which leaves no room for a second query, so the parents are joined in"""
+    return query.options(db.joinedload(Post.parent_post))
+
+
+def posts_version(*criteria):
+    """Validator of a set of posts: count, newest id and newest modification in one aggregate query"""
+    count, max_id, last_modified = db.session.query(db.func.count(Post.id), db.func.max(Post.id),
+                                                    db.func.max(Post.last_modified)).filter(*criteria).one()
+    return '%s-%s-%s' % (count, max_id, last_modified), last_modified
+
+
+def post_version(id):
+    row = db.session.query(Post.last_modified).filter(Post.id == id).first()
+    if row is None:
+        return None, None
+    return '%s-%s' % (id, row.last_modified), row.last_modified
+
+
+def posts_list_version():
+    """Validator of /posts/ without scanning the table: new posts raise max(id), edits raise the indexed
+    max(last_modified), deletes bump the posts_deleted counter. Comments count too, which only costs
+    a spare 200"""
+    ids = requested_ids()
+    if ids is not None:
+        return posts_version(Post.id.in_(ids)) if ids else (None, None)
+    max_id, last_modified = db.session.query(db.func.max(Post.id), db.func.max(Post.last_modified)).one()
+    deleted, deleted_at = ChangeCounter.get('posts_deleted')
+    if deleted_at is not None and (last_modified is None or deleted_at > last_modified):
+        last_modified = deleted_at
+    return '%s-%s-%s' % (max_id, last_modified, deleted), last_modified
+
+
 @api.route("/posts/")
+@read_only
 @auth.login_required
+@conditional(posts_list_version)
 def get_posts():
-    page = request.args.get("page", 1, type=int)
+    ids = requested_ids()
+    if ids is not None:
+        # 批量获取：?ids=1,2,3 一次查询，按请求的顺序返回
+        posts, missing = get_many(Post.query, Post.id, ids)
+        return jsonify(posts=[post.to_json() for post in load_parents(load_authors(posts))], missing=missing)
     size = request.args.get('size', 10, type=int)
-    pagination = Post.query. \
-        filter_by(post_type=PostType.POST). \
-        order_by(Post.timestamp.desc()).paginate(page, size, error_out=False)
+    query = Post.query.filter_by(post_type=PostType.POST)
+    page = request.args.get("page", type=int)
+    if page is not None:
+        # 旧客户端仍然按页码翻页
+        pagination = query.order_by(Post.timestamp.desc()).paginate(page, size, error_out=False)
+        next = url_for('.get_posts', page=page + 1, size=size, _external=True) if pagination.has_next else None
+        prev = url_for('.get_posts', page=page - 1, size=size, _external=True) if pagination.has_prev else None
+    else:
+        pagination = paginate_keyset(query, [Post.timestamp, Post.id], per_page=size,
+                                     count=request.args.get('count', 0, type=int) == 1)
+        next = url_for('.get_posts', cursor=pagination.next_cursor, size=size, _external=True) \
+            if pagination.has_next else None
+        prev = url_for('.get_posts', cursor=pagination.prev_cursor, size=size, _external=True) \
+            if pagination.has_prev else None
     posts = pagination.items
-    next = url_for('.get_posts', page=page + 1, _external=True) if pagination.has_next else None
-    prev = url_for('.get_posts', page=page - 1, _external=True) if pagination.has_prev else None
     count = pagination.total
 
     return jsonify(posts=[post.to_json() for post in posts], next=next, prev=prev, count=count)
 
 
+@api.route('/search')
+@read_only
+@auth.login_required
+def search():
+    q = request.args.get('q', '')
+    page = request.args.get('page', 1, type=int)
+    size = request.args.get('size', 10, type=int)
+    pagination = Post.search(q).paginate(page, size, error_out=False)
+    next = url_for('.search', q=q, page=page + 1, size=size, _external=True) if pagination.has_next else None
+    prev = url_for('.search', q=q, page=page - 1, size=size, _external=True) if pagination.has_prev else None
+    posts = load_parents(load_authors(pagination.items))
+    return jsonify(posts=[post.to_json() for post in posts], next=next, prev=prev, count=pagination.total)
+
+
 @api.route('/posts/<int:id>')
+@read_only
 @auth.login_required
+@conditional(post_version, max_age=30)
 def get_post(id):
     post = Post.query.get_or_404(id)
     return jsonify(post.to_json())
@@ -38,7 +108,7 @@ def get_post(id):
 def modify_post(id):
     if request.json and request.json.get('body'):
         post = Post.query.get_or_404(id)
-        if g.current_user.can(Permission.MODERATE_COMMENTS) or post.author == g.current_user:
+        if g.current_user.can(Permission.MODERATE_COMMENTS) or post.author_id == g.current_user.id:
             post.body = request.json.get('body')
             db.session.add(post)
             db.session.commit()
@@ -50,15 +120,31 @@ def modify_post(id):
 
 
 @api.route('/users/<int:id>/posts/')
+@read_only
+@conditional(lambda id: posts_version(Post.author_id == id))
 def get_user_posts(id):
     user = User.query.get_or_404(id)
-    return jsonify(posts=[post.to_json() for post in user.posts])
+    return collection('posts', with_parents(user.posts.order_by(Post.id)))
+
+
+def timeline_posts(user, size):
+    """Every post of user's home timeline, newest first, read one keyset page of size posts at a time"""
+    cursor = None
+    while True:
+        pagination = MergedKeysetPagination(Timeline.branches(user), cursor=cursor, per_page=size,
+                                            key=Timeline.post_key, load=Timeline.load_posts)
+        for post in load_parents(pagination.items):
+            yield post
+        if not pagination.has_next:
+            return
+        cursor = pagination.next_cursor
 
 
 @api.route('/users/<int:id>/timeline/')
+@read_only
 def get_user_follows_posts(id):
     user = User.query.get_or_404(id)
-    return jsonify(posts=[post.to_json() for post in user.followed_posts])
+    return collection('posts', timeline_posts(user, current_app.config['API_STREAM_CHUNK_SIZE']))
 
 
 @api.route('/posts/', methods=['POST'])
@@ -67,7 +153,7 @@ def get_user_follows_posts(id):
 def new_post():
     if request.json:
         post = Post.from_json(request.json)
-        post.author = g.current_user
+        post.author_id = g.current_user.id
         db.session.add(post)
         db.session.commit()
         return jsonify(post.to_json()), 201
@@ -75,13 +161,72 @@ def new_post():
         raise ValidationError("body is Empty")
 
 
+def create_many(items, build):
+    """Validate every item with build(json) and insert the valid ones in one transaction.
+
+    Returns the per-item results and the status of the whole request: 201 when everything
+    was created, 207 when only some items were, 412 when none was.
+    """
+    results = []
+    created = []
+    for item in items:
+        try:
+            if not isinstance(item, dict):
+                raise ValidationError('item 必须是对象')
+            post = build(item)
+        except ValidationError as e:
+            results.append({'status': 412, 'error': e.args[0]})
+        else:
+            db.session.add(post)
+            created.append(post)
+            results.append(post)
+    # flush 后即有 id，在 commit 之前序列化，避免 commit 过期对象后逐个重新加载
+    db.session.flush()
+    results = [{'status': 201, 'post': result.to_json()} if isinstance(result, Post) else result
+               for result in results]
+    db.session.commit()
+    if len(created) == len(items):
+        status = 201
+    else:
+        status = 207 if created else 412
+    return jsonify(results=results, created=len(created)), status
+
+
+@api.route('/posts/batch', methods=['POST'])
+@auth.login_required
+@permission_required(Permission.POST_ARTICLES)
+def new_posts():
+    def build(item):
+        post = Post.from_json(item)
+        post.author_id = g.current_user.id
+        return post
+
+    return create_many(json_items(), build)
+
+
+@api.route('/posts/<int:id>/comments/batch', methods=['POST'])
+@auth.login_required
+@permission_required(Permission.COMMENT)
+def new_comments(id):
+    post = Post.query.get_or_404(id)
+
+    def build(item):
+        comment = Post.from_json(item, True)
+        comment.author_id = g.current_user.id
+        comment.parent_post_id = post.id
+        comment.disabled = not g.current_user.confirmed
+        return comment
+
+    return create_many(json_items(), build)
+
+
 @api.route('/posts/<int:id>/comments/', methods=['POST'])
 @auth.login_required
 @permission_required(Permission.COMMENT)
 def new_comment(id):
     if request.json:
         post = Post.from_json(request.json, True)
-        post.author = g.current_user
+        post.author_id = g.current_user.id
         post.parent_post_id = id
         post.disabled = not g.current_user.confirmed
         db.session.add(post)
@@ -92,11 +237,45 @@ def new_comment(id):
 
 
 @api.route('/posts/<int:id>/comments/')
+@read_only
+@conditional(lambda id: posts_version(Post.parent_post_id == id))
 def get_post_comments(id):
     post = Post.query.get_or_404(id)
-    return jsonify(comments=[comment.to_json() for comment in post.comments])
+    return collection('comments', with_parents(post.comments.order_by(Post.id)))
+
+
+def thread_json(comment):
+    json_comment = comment.to_json()
+    json_comment['replies'] = [thread_json(reply) for reply in comment.replies]
+    json_comment['more_replies'] = url_for('.get_post_thread', id=comment.id, _external=True) \
+        if comment.more_replies else None
+    return json_comment
+
+
+@api.route('/posts/<int:id>/thread')
+@read_only
+def get_post_thread(id):
+    """A page of the comments of a post with their replies nested, the whole tree in two queries
+    (one per level on a server without WITH RECURSIVE).
+
+    size/cursor page the direct comments; depth and replies bound the nested trees, a comment
+    whose tree was cut has a more_replies url that continues below it.
+    """
+    post = Post.query.get_or_404(id)
+    size = min(request.args.get('size', 10, type=int), current_app.config['API_BATCH_LIMIT'])
+    depth = min(request.args.get('depth', current_app.config['THREAD_MAX_DEPTH'], type=int),
+                current_app.config['THREAD_MAX_DEPTH'])
+    replies = min(request.args.get('replies', current_app.config['THREAD_MAX_REPLIES'], type=int),
+                  current_app.config['THREAD_MAX_REPLIES'])
+    pagination = paginate_keyset(post.comments, [Post.timestamp, Post.id], per_page=size, descending=False)
+    load_replies(pagination.items, max_depth=depth, limit=replies)
+    next = url_for('.get_post_thread', id=id, cursor=pagination.next_cursor, size=size, depth=depth,
+                   replies=replies, _external=True) if pagination.has_next else None
+    return jsonify(post=url_for('.get_post', id=id, _external=True),
+                   comments=[thread_json(comment) for comment in pagination.items], next=next)
 
 
 @api.route('/posts/<int:parent_id>/comments/<int:id>')
+@read_only
 def get_post_comment(parent_id, id):
     return jsonify(comment=Post.query.get_or_404(id))
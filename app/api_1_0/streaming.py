@@ -0,0 +1,52 @@
+from flask import request, current_app, json, jsonify, stream_with_context
+
+NDJSON = 'application/x-ndjson'
+
+
+def streaming_mode():
+    """'ndjson', 'json' (a chunked JSON document) or None when the client wants a plain response"""
+    mode = request.args.get('stream')
+    if mode in ('ndjson', 'json'):
+        return mode
+    if request.accept_mimetypes.best == NDJSON:
+        return 'ndjson'
+    return None
+
+
+def collection(key, query, serialize=lambda item: item.to_json()):
+    """jsonify(key=[...]) of every row of query, or the same rows streamed when the client asks.
+
+    Streaming iterates the query with yield_per (a server side cursor on MySQL) and sends
+    API_STREAM_CHUNK_SIZE records per write, so memory stays flat however many rows match.
+    query may also be any iterable of items that already reads in chunks, e.g. a generator of pages.
+    """
+    mode = streaming_mode()
+    if mode is None:
+        return jsonify(**{key: [serialize(item) for item in query]})
+    chunk_size = current_app.config['API_STREAM_CHUNK_SIZE']
+
+    def records():
+        chunk = []
+        for item in (query.yield_per(chunk_size) if hasattr(query, 'yield_per') else query):
+            chunk.append(json.dumps(serialize(item)))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def ndjson():
+        for chunk in records():
+            yield '\n'.join(chunk) + '\n'
+
+    def document():
+        yield '{"%s": [' % key
+        separator = ''
+        for chunk in records():
+            yield separator + ','.join(chunk)
+            separator = ','
+        yield ']}\n'
+
+    if mode == 'ndjson':
+        return current_app.response_class(stream_with_context(ndjson()), mimetype=NDJSON)
+    return current_app.response_class(stream_with_context(document()), mimetype='application/json')
@@ -0,0 +1,190 @@
+import json
+import random
+import threading
+import time
+from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor
+
+from . import db
+from .seed import SEED_PASSWORD
+
+
+class QueryCounter:
+    """Counts the SQL statements executed by the current thread"""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def install(self, engine):
+        db.event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+    def reset(self):
+        self._local.count = 0
+
+    @property
+    def count(self):
+        return getattr(self._local, 'count', 0)
+
+
+class Scenario:
+    """One endpoint under load: build(rng) returns the path of the next request, login one of
+    None, 'session', 'token' or 'basic' says how the client authenticates"""
+
+    def __init__(self, name, build, login=None):
+        self.name = name
+        self.build = build
+        self.login = login
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def basic_auth(username, password=''):
+    return {'Authorization': 'Basic ' + b64encode(('%s:%s' % (username, password)).encode('utf-8')).decode()}
+
+
+def prepare_dataset(app, scale, seed=42):
+    """Seed the benchmark database unless it already holds users; scale is the number of users"""
+    from .models import Role, User
+    from .seed import Seeder
+    with app.app_context():
+        db.create_all()
+        if User.query.first() is None:
+            Role.insert_roles()
+            Seeder(users=scale, follows=20, posts=scale * 10, comments=scale * 20, seed=seed).run()
+        db.session.remove()
+
+
+class Benchmark:
+    """Drives concurrent requests through the WSGI app, one test client per worker thread.
+
+    The HTTP server is left out on purpose: what is measured is the app, its queries and
+    its templates, which is what changes between commits.
+    """
+
+    def __init__(self, app, requests=200, concurrency=8, warmup=20, seed=42):
+        self.app = app
+        self.requests = requests
+        self.concurrency = concurrency
+        self.warmup = warmup
+        self.seed = seed
+        self.queries = QueryCounter()
+        with app.app_context():
+            self.queries.install(db.engine)
+
+    def scenarios(self):
+        from .models import User, Post, PostType
+        with self.app.app_context():
+            user_ids = [row.id for row in db.session.query(User.id).order_by(User.id).limit(1000)]
+            post_ids = [row.id for row in db.session.query(Post.id).filter(Post.post_type == PostType.POST)
+                        .order_by(Post.id.desc()).limit(1000)]
+            db.session.remove()
+        return [
+            Scenario('home', lambda rng: '/'),
+            Scenario('post', lambda rng: '/post/%d' % rng.choice(post_ids)),
+            Scenario('user', lambda rng: '/user/%d' % rng.choice(user_ids)),
+            Scenario('followed_posts', lambda rng: '/followed_post', login='session'),
+            Scenario('api_posts', lambda rng: '/api/1.0/posts/', login='token'),
+            Scenario('api_post', lambda rng: '/api/1.0/posts/%d' % rng.choice(post_ids), login='token'),
+            Scenario('api_timeline', lambda rng: '/api/1.0/users/%d/timeline/' % rng.choice(user_ids),
+                     login='token'),
+            Scenario('api_token', lambda rng: '/api/1.0/token', login='basic'),
+        ]
+
+    def client(self, login, email):
+        """A test client and the headers of its requests, authenticated as `email`"""
+        client = self.app.test_client()
+        if login == 'session':
+            client.post('/auth/login', data={'email': email, 'password': SEED_PASSWORD})
+            return client, {}
+        if login == 'basic':
+            return client, basic_auth(email, SEED_PASSWORD)
+        if login == 'token':
+            token = client.get('/api/1.0/token', headers=basic_auth(email, SEED_PASSWORD)).get_json()['token']
+            return client, basic_auth(token)
+        return client, {}
+
+    def run(self, names=None):
+        from .models import User
+        with self.app.app_context():
+            emails = [row.email for row in db.session.query(User.email).filter(User.confirmed == True)
+                      .order_by(User.id).limit(self.concurrency)]
+            db.session.remove()
+        results = {}
+        for scenario in self.scenarios():
+            if names and scenario.name not in names:
+                continue
+            results[scenario.name] = self.run_scenario(scenario, emails)
+            print(format_result(scenario.name, results[scenario.name]))
+        return results
+
+    def run_scenario(self, scenario, emails):
+        latencies = []
+        queries = []
+        errors = [0]
+        lock = threading.Lock()
+        per_worker = max(1, self.requests // self.concurrency)
+
+        def work(worker):
+            rng = random.Random('%s-%s-%d' % (self.seed, scenario.name, worker))
+            client, headers = self.client(scenario.login, emails[worker % len(emails)])
+            for i in range(self.warmup // self.concurrency + per_worker):
+                path = scenario.build(rng)
+                self.queries.reset()
+                started = time.perf_counter()
+                response = client.get(path, headers=headers)
+                elapsed = time.perf_counter() - started
+                if i < self.warmup // self.concurrency:
+                    continue
+                with lock:
+                    latencies.append(elapsed)
+                    queries.append(self.queries.count)
+                    if response.status_code >= 400:
+                        errors[0] += 1
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(self.concurrency) as pool:
+            list(pool.map(work, range(self.concurrency)))
+        wall = time.perf_counter() - started
+        return {'requests': len(latencies),
+                'errors': errors[0],
+                'throughput': len(latencies) / wall if wall else None,
+                'mean_ms': 1000 * sum(latencies) / len(latencies),
+                'p50_ms': 1000 * percentile(latencies, 50),
+                'p95_ms': 1000 * percentile(latencies, 95),
+                'p99_ms': 1000 * percentile(latencies, 99),
+                'queries_per_request': sum(queries) / len(queries),
+                'max_queries': max(queries)}
+
+
+def format_result(name, result):
+    return '%-16s %6d req %4d err %8.1f req/s  p50 %7.1fms  p95 %7.1fms  p99 %7.1fms  %5.1f queries/req' % (
+        name, result['requests'], result['errors'], result['throughput'], result['p50_ms'], result['p95_ms'],
+        result['p99_ms'], result['queries_per_request'])
+
+
+def save_report(path, report):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+
+def compare_reports(baseline, current):
+    """Lines describing how each scenario of current changed against baseline"""
+    lines = []
+    for name, result in sorted(current['results'].items()):
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        lines.append('%-16s throughput %+6.1f%%  p95 %+6.1f%%  queries/req %+.1f' % (
+            name,
+            100.0 * (result['throughput'] / before['throughput'] - 1) if before['throughput'] else 0,
+            100.0 * (result['p95_ms'] / before['p95_ms'] - 1) if before['p95_ms'] else 0,
+            result['queries_per_request'] - before['queries_per_request']))
+    return lines
@@ -1,22 +1,132 @@
-from threading import Thread
+import smtplib
+import threading
+import uuid
+from datetime import datetime, timedelta
 
 from flask import current_app, render_template
 from flask_mail import Message
 
-from . import mail
+from . import mail, db
+from .models import OutgoingMail, MailStatus
 
 
 def send_email(to, subject, template, body=None, html=None, **kwargs):
+    """Render the mail now and queue it in the outbox; manage.py mailworker delivers it"""
     app = current_app._get_current_object()
-    msg = Message(app.config['MAIL_SUBJECT_PREFIX'] + subject, sender=app.config['MAIL_SENDER'],
-                  recipients=[to])
-    msg.body = body or render_template(template + '.txt', **kwargs)
-    msg.html = html or render_template(template + ".html", **kwargs)
-    thr = Thread(target=send_async_email, args=[app, msg])
-    thr.start()
-    return thr
-
-
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
+    outgoing = OutgoingMail(sender=app.config['MAIL_SENDER'],
+                            recipient=to,
+                            subject=app.config['MAIL_SUBJECT_PREFIX'] + subject,
+                            body=body or render_template(template + '.txt', **kwargs),
+                            html=html or render_template(template + ".html", **kwargs))
+    db.session.add(outgoing)
+    db.session.commit()
+    return outgoing
+
+
+class MailWorker:
+    """A fixed pool of threads that claim batches from the outbox and send each batch over one SMTP connection"""
+
+    def __init__(self, app, workers=2, batch_size=20, max_attempts=5, backoff=60, lease=300, poll_interval=5):
+        self.app = app
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+
+    def run(self, once=False):
+        threads = [threading.Thread(target=self._work, args=(once,), name='mailworker-%d' % i)
+                   for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(1)
+        except KeyboardInterrupt:
+            self.stop()
+            for thread in threads:
+                thread.join()
+
+    def stop(self):
+        self._stop.set()
+
+    def claim(self):
+        now = datetime.utcnow()
+        token = uuid.uuid4().hex
+        due = db.session.query(OutgoingMail.id) \
+            .filter(OutgoingMail.status.in_([MailStatus.PENDING, MailStatus.SENDING]),
+                    OutgoingMail.next_attempt_at <= now) \
+            .order_by(OutgoingMail.next_attempt_at).limit(self.batch_size)
+        ids = [row.id for row in due]
+        if not ids:
+            return []
+        # 只有条件仍然成立的行会被这个 token 领取，多个进程同时领取也不会重复发送
+        OutgoingMail.query.filter(OutgoingMail.id.in_(ids),
+                                  OutgoingMail.status.in_([MailStatus.PENDING, MailStatus.SENDING]),
+                                  OutgoingMail.next_attempt_at <= now) \
+            .update({'status': MailStatus.SENDING, 'claim': token,
+                     'next_attempt_at': now + timedelta(seconds=self.lease)}, synchronize_session=False)
+        db.session.commit()
+        return OutgoingMail.query.filter_by(claim=token).all()
+
+    def _work(self, once):
+        with self.app.app_context():
+            try:
+                while not self._stop.is_set():
+                    batch = self.claim()
+                    if not batch:
+                        if once:
+                            return
+                        self._stop.wait(self.poll_interval)
+                        continue
+                    self._send_batch(batch)
+            finally:
+                db.session.remove()
+
+    def _send_batch(self, batch):
+        try:
+            with mail.connect() as connection:
+                for outgoing in batch:
+                    try:
+                        connection.send(Message(outgoing.subject, sender=outgoing.sender,
+                                                recipients=[outgoing.recipient],
+                                                body=outgoing.body, html=outgoing.html))
+                    except smtplib.SMTPServerDisconnected as e:
+                        # 连接断开，剩下的邮件留给下一次重试
+                        for rest in batch[batch.index(outgoing):]:
+                            self._failed(rest, e)
+                        break
+                    except Exception as e:
+                        self._failed(outgoing, e)
+                    else:
+                        self._sent(outgoing)
+        except Exception as e:
+            current_app.logger.warning('mailworker: smtp connection failed: %s' % e)
+            for outgoing in batch:
+                if outgoing.status == MailStatus.SENDING:
+                    self._failed(outgoing, e)
+        db.session.commit()
+
+    def _sent(self, outgoing):
+        outgoing.status = MailStatus.SENT
+        outgoing.sent_at = datetime.utcnow()
+        outgoing.attempts += 1
+        outgoing.claim = None
+        db.session.add(outgoing)
+
+    def _failed(self, outgoing, error):
+        outgoing.attempts += 1
+        outgoing.last_error = str(error)
+        outgoing.claim = None
+        if outgoing.attempts >= self.max_attempts:
+            outgoing.status = MailStatus.FAILED
+            current_app.logger.error('mailworker: giving up on mail %d to %s: %s' %
+                                     (outgoing.id, outgoing.recipient, error))
+        else:
+            outgoing.status = MailStatus.PENDING
+            outgoing.next_attempt_at = datetime.utcnow() + \
+                timedelta(seconds=self.backoff * 2 ** (outgoing.attempts - 1))
+        db.session.add(outgoing)
@@ -1,2 +1,11 @@
 class ValidationError(ValueError):
     pass
+
+
+class MalformedRequest(ValidationError):
+    """A query string the API can't use, answered with 400 instead of the 412 of an invalid body"""
+    pass
+
+
+class PasswordHasherBusy(RuntimeError):
+    pass
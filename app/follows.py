@@ -0,0 +1,105 @@
+from array import array
+from bisect import bisect_left, insort
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from .cache import LRUCache
+
+
+def contains(ids, id):
+    i = bisect_left(ids, id)
+    return i < len(ids) and ids[i] == id
+
+
+class FollowGraph:
+    """Process level index of who follows whom: per follower a sorted array('l') of followed ids.
+
+    Lists are loaded lazily with one query and kept in an LRU bounded by FOLLOW_GRAPH_USERS
+    followers; lists longer than FOLLOW_GRAPH_MAX_EDGES are never cached. Changes made through
+    this process are applied when their transaction commits, changes made by other processes
+    show up once the entry expires after FOLLOW_GRAPH_TTL seconds.
+    """
+
+    def __init__(self, maxsize=10000, ttl=60, max_edges=50000):
+        self.lists = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.max_edges = max_edges
+
+    def init_app(self, app):
+        self.lists = LRUCache(maxsize=app.config['FOLLOW_GRAPH_USERS'], ttl=app.config['FOLLOW_GRAPH_TTL'])
+        self.max_edges = app.config['FOLLOW_GRAPH_MAX_EDGES']
+
+    def load(self, follower_id):
+        from . import db
+        from .models import Follow
+        return array('l', (row[0] for row in db.session.query(Follow.followed_id)
+                           .filter(Follow.follower_id == follower_id).order_by(Follow.followed_id)))
+
+    def followed_ids(self, follower_id):
+        ids = self.lists.get(follower_id)
+        if ids is None:
+            ids = self.load(follower_id)
+            if len(ids) <= self.max_edges:
+                self.lists.set(follower_id, ids)
+        return ids
+
+    def is_following(self, follower_id, followed_id):
+        return contains(self.followed_ids(follower_id), followed_id)
+
+    def following_among(self, follower_id, ids):
+        """The subset of ids that follower_id follows, one lookup for a whole page of users"""
+        followed = self.followed_ids(follower_id)
+        return {id for id in ids if contains(followed, id)}
+
+    def add(self, follower_id, followed_id):
+        ids = self.lists.get(follower_id)
+        if ids is not None and not contains(ids, followed_id):
+            insort(ids, followed_id)
+
+    def remove(self, follower_id, followed_id):
+        ids = self.lists.get(follower_id)
+        if ids is not None and contains(ids, followed_id):
+            ids.pop(bisect_left(ids, followed_id))
+
+    def verify(self):
+        """Compare every cached list with the follow table, drop and return the followers that differ"""
+        stale = []
+        for follower_id in self.lists.keys():
+            ids = self.lists.get(follower_id)
+            if ids is not None and ids != self.load(follower_id):
+                self.lists.delete(follower_id)
+                stale.append(follower_id)
+        return stale
+
+    def stats(self):
+        return dict(self.lists.stats(), max_edges=self.max_edges)
+
+    # Follow 的 mapper 事件把改动记在 session 上，事务提交后才写入索引，回滚则丢弃
+    @staticmethod
+    def on_follow_insert(mapper, connection, target):
+        pending(target).append((target.follower_id, target.followed_id, True))
+
+    @staticmethod
+    def on_follow_delete(mapper, connection, target):
+        pending(target).append((target.follower_id, target.followed_id, False))
+
+
+def pending(target):
+    return object_session(target).info.setdefault('follow_changes', [])
+
+
+@event.listens_for(Session, 'after_commit')
+def apply_follow_changes(session):
+    for follower_id, followed_id, followed in session.info.pop('follow_changes', ()):
+        if followed:
+            follow_graph.add(follower_id, followed_id)
+        else:
+            follow_graph.remove(follower_id, followed_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_follow_changes(session):
+    session.info.pop('follow_changes', None)
+
+
+follow_graph = FollowGraph()
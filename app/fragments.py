@@ -0,0 +1,115 @@
+import hashlib
+
+from flask import request
+from flask_login import current_user
+from markupsafe import Markup
+
+from .cache import LRUCache
+
+# 修改被缓存的模板片段的结构后加一，共享缓存里的旧片段随之失效
+FRAGMENT_VERSION = 2
+
+
+class FragmentCache:
+    """Rendered html fragments, in a process local LRU with an optional shared memcached/redis backend.
+
+    Keys embed the version of what they render (post id + last_modified, author name ...), so an
+    edit produces a new key; invalidate_post only frees the entries of the old version early.
+    """
+
+    def __init__(self, maxsize=4096):
+        self.local = LRUCache(maxsize=maxsize)
+        self.shared = None
+        self.timeout = 3600
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        self.local.maxsize = app.config['FRAGMENT_CACHE_SIZE']
+        self.timeout = app.config['FRAGMENT_CACHE_TIMEOUT']
+        backend = app.config['FRAGMENT_CACHE_BACKEND']
+        if backend.startswith('redis://'):
+            from werkzeug.contrib.cache import RedisCache
+            from redis import from_url
+            self.shared = RedisCache(from_url(backend), default_timeout=self.timeout, key_prefix='fragment:')
+        elif backend.startswith('memcached://'):
+            from werkzeug.contrib.cache import MemcachedCache
+            self.shared = MemcachedCache(backend[len('memcached://'):].split(','),
+                                         default_timeout=self.timeout, key_prefix='fragment:')
+        app.jinja_env.globals.update(cached_fragment=self.cached_fragment,
+                                     post_fragment_key=post_fragment_key,
+                                     posts_fragment_version=posts_fragment_version,
+                                     comment_viewer=comment_viewer)
+
+    def get(self, key):
+        html = self.local.get(key)
+        if html is None and self.shared is not None:
+            html = self.shared.get(key)
+            if html is not None:
+                self.local.set(key, html)
+        if html is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return html
+
+    def set(self, key, html):
+        self.local.set(key, html, ttl=self.timeout)
+        if self.shared is not None:
+            self.shared.set(key, html)
+
+    def delete(self, key):
+        self.local.delete(key)
+        if self.shared is not None:
+            self.shared.delete(key)
+
+    def cached_fragment(self, *key, **kwargs):
+        """Jinja helper: {% call cached_fragment(<key parts>) %}...{% endcall %}"""
+        caller = kwargs.pop('caller')
+        key = make_key(key)
+        html = self.get(key)
+        if html is None:
+            html = str(caller())
+            self.set(key, html)
+        return Markup(html)
+
+    def invalidate_post(self, post):
+        self.delete(make_key(post_fragment_key(post)))
+        for viewer in ('moderator', 'author', 'reader'):
+            self.delete(make_key(post_fragment_key(post, viewer)))
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'local': self.local.stats(),
+                'shared': self.shared is not None}
+
+
+def make_key(parts):
+    raw = '|'.join(str(part) for part in parts)
+    return 'f%d:%s' % (FRAGMENT_VERSION, hashlib.sha1(raw.encode('utf-8')).hexdigest())
+
+
+def post_fragment_key(post, viewer=None):
+    author = post.author
+    return ('post', post.id, post.last_modified, post.comments_count, post.disabled,
+            author.username if author else None, author.avatar if author else None,
+            request.is_secure, viewer)
+
+
+def posts_fragment_version(posts):
+    return make_key([make_key(post_fragment_key(post)) for post in posts])
+
+
+def comment_viewer(comment):
+    """The part of a comment fragment that depends on who is looking at it"""
+    from .models import Permission
+    if current_user.can(Permission.MODERATE_COMMENTS):
+        return 'moderator'
+    if current_user.is_authenticated and current_user.id == comment.author_id:
+        return 'author'
+    return 'reader'
+
+
+fragment_cache = FragmentCache()
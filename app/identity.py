@@ -0,0 +1,119 @@
+import hashlib
+import threading
+import time
+from collections import namedtuple
+
+from flask import current_app
+from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
+
+from .cache import LRUCache
+from .presence import last_seen_buffer
+
+
+class Identity(namedtuple('Identity', ['id', 'username', 'confirmed', 'permissions'])):
+    """Immutable, session free snapshot of an authenticated user, enough for permission checks"""
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
+    @staticmethod
+    def from_user(user):
+        return Identity(user.id, user.username, bool(user.confirmed),
+                        user.role.permissions if user.role is not None else 0)
+
+    def get_id(self):
+        return str(self.id)
+
+    def can(self, permissions):
+        return (self.permissions & permissions) == permissions
+
+    def is_administrator(self):
+        from .models import Permission
+        return self.can(Permission.ADMINISTER)
+
+    def ping(self):
+        last_seen_buffer.touch(self.id)
+
+
+token_cache = LRUCache(maxsize=10000)
+identity_cache = LRUCache(maxsize=10000, ttl=300)
+_serializers = {}
+# user id -> generation, bumped on invalidation so cached entries of older generations are ignored
+_generations = {}
+_lock = threading.Lock()
+
+
+def get_serializer(secret_key, expires_in=None):
+    key = (secret_key, expires_in)
+    serializer = _serializers.get(key)
+    if serializer is None:
+        serializer = _serializers[key] = Serializer(secret_key, expires_in)
+    return serializer
+
+
+def invalidate_user(user_id):
+    if user_id is None:
+        return
+    with _lock:
+        _generations[user_id] = _generations.get(user_id, 0) + 1
+
+
+def cached_identity(user_id):
+    cached = identity_cache.get(user_id)
+    if cached is not None and _generations.get(user_id, 0) == cached[1]:
+        return cached[0]
+    return None
+
+
+def identity_for(user):
+    """The cached Identity of a user, rebuilt after invalidate_user or when the entry expires"""
+    if user.id is None:
+        return Identity.from_user(user)
+    identity = cached_identity(user.id)
+    if identity is not None:
+        return identity
+    generation = _generations.get(user.id, 0)
+    identity = Identity.from_user(user)
+    identity_cache.set(user.id, (identity, generation))
+    return identity
+
+
+def clear_cache():
+    """Forget every cached identity, e.g. after role permissions changed"""
+    token_cache.clear()
+    identity_cache.clear()
+
+
+def verify_auth_token(token, uuid):
+    """Return the Identity of a valid auth token, cached until the token expires or the user changes"""
+    if isinstance(token, str):
+        token = token.encode('utf-8')
+    key = '%s:%s' % (hashlib.sha256(token).hexdigest(), uuid)
+    cached = token_cache.get(key)
+    if cached is not None:
+        identity, generation = cached
+        if _generations.get(identity.id, 0) == generation:
+            return identity
+        token_cache.delete(key)
+
+    from . import db
+    from .models import User
+    s = get_serializer(current_app.config['SECRET_KEY'])
+    try:
+        data, header = s.loads(token, return_header=True)
+        if data.get('uuid') != uuid:
+            raise ValueError("uuid exception")
+    except Exception as e:
+        current_app.logger.info('invalid auth token: %s' % e)
+        return None
+    generation = _generations.get(data['id'], 0)
+    identity = cached_identity(data['id'])
+    if identity is None:
+        user = User.query.options(db.joinedload(User.role)).filter_by(id=data['id']).first()
+        if user is None:
+            return None
+        identity = identity_for(user)
+    ttl = min(header.get('exp', 0) - time.time(), current_app.config['TOKEN_CACHE_TTL'])
+    if ttl > 0:
+        token_cache.set(key, (identity, generation), ttl=ttl)
+    return identity
@@ -0,0 +1,229 @@
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from . import db
+
+jobs = OrderedDict()
+
+
+def register(job_class):
+    jobs[job_class.name] = job_class
+    return job_class
+
+
+class MaintenanceJob:
+    """A backfill or repair step run by manage.py maintenance / deploy.
+
+    pending() must be cheap: it is what --dry-run prints and what decides whether run() has
+    anything to do.
+    """
+    name = None
+    help = ''
+
+    def __init__(self, chunk_size=1000, dry_run=False, restart=False):
+        self.chunk_size = chunk_size
+        self.dry_run = dry_run
+        self.restart = restart
+        self.started = time.time()
+
+    def log(self, message):
+        print('%s: %s (%.1fs)' % (self.name, message, time.time() - self.started))
+
+    @property
+    def checkpoint_name(self):
+        return self.name
+
+    def checkpoint(self):
+        from .models import JobCheckpoint
+        checkpoint = JobCheckpoint.query.get(self.checkpoint_name)
+        if checkpoint is None:
+            checkpoint = JobCheckpoint(name=self.checkpoint_name, processed=0)
+        return checkpoint
+
+    def pending(self):
+        raise NotImplementedError
+
+    def run(self):
+        raise NotImplementedError
+
+
+class SetBasedJob(MaintenanceJob):
+    """A job done by a few statements over the whole table, execute() returns the rows changed"""
+
+    def execute(self):
+        raise NotImplementedError
+
+    def run(self):
+        pending = self.pending()
+        self.log('%d pending%s' % (pending, ', dry run' if self.dry_run else ''))
+        if self.dry_run or not pending:
+            return 0
+        done = self.execute()
+        checkpoint = self.checkpoint()
+        checkpoint.processed = done
+        checkpoint.finished_at = datetime.utcnow()
+        db.session.add(checkpoint)
+        db.session.commit()
+        self.log('%d done' % done)
+        return done
+
+
+class ChunkedJob(MaintenanceJob):
+    """A job walking `key` in ascending keyset chunks, committing the checkpoint with each chunk.
+
+    An interrupted run continues after the last committed chunk; a finished job has nothing
+    pending until it is restarted.
+    """
+    key = None
+
+    def query(self):
+        """Rows to process, a query selecting only the key column"""
+        raise NotImplementedError
+
+    def process(self, keys):
+        raise NotImplementedError
+
+    def pending(self):
+        checkpoint = self.checkpoint()
+        if checkpoint.finished_at is not None and not self.restart:
+            return 0
+        last_key = None if self.restart else checkpoint.last_key
+        query = self.query()
+        if last_key is not None:
+            query = query.filter(self.key > last_key)
+        return query.count()
+
+    def run(self):
+        pending = self.pending()
+        self.log('%d pending%s' % (pending, ', dry run' if self.dry_run else ''))
+        if self.dry_run or not pending:
+            return 0
+        checkpoint = self.checkpoint()
+        if self.restart or checkpoint.finished_at is not None:
+            checkpoint.last_key = None
+            checkpoint.processed = 0
+            checkpoint.started_at = datetime.utcnow()
+            checkpoint.finished_at = None
+        done = 0
+        while True:
+            query = self.query()
+            if checkpoint.last_key is not None:
+                query = query.filter(self.key > checkpoint.last_key)
+            keys = [row[0] for row in query.order_by(self.key).limit(self.chunk_size)]
+            if not keys:
+                break
+            self.process(keys)
+            checkpoint.last_key = keys[-1]
+            checkpoint.processed = (checkpoint.processed or 0) + len(keys)
+            db.session.add(checkpoint)
+            db.session.commit()
+            done += len(keys)
+            elapsed = time.time() - self.started
+            self.log('%d/%d, last key %d, %.1f rows/s' % (done, pending, keys[-1], done / (elapsed or 1)))
+        checkpoint.finished_at = datetime.utcnow()
+        db.session.add(checkpoint)
+        db.session.commit()
+        return done
+
+
+@register
+class InsertRoles(SetBasedJob):
+    name = 'roles'
+    help = 'Create the roles and sync their permissions'
+
+    def pending(self):
+        # 只有几行，每次部署都同步
+        return 1
+
+    def execute(self):
+        from .models import Role
+        Role.insert_roles()
+        return Role.query.count()
+
+
+@register
+class SelfFollows(SetBasedJob):
+    name = 'self_follows'
+    help = 'Make every user follow themself, with one INSERT ... SELECT'
+
+    def pending(self):
+        from .models import User
+        return User.without_self_follow().count()
+
+    def execute(self):
+        from .models import User
+        return User.follow_them_self()
+
+
+@register
+class Recount(SetBasedJob):
+    name = 'recount'
+    help = 'Repair the post, comment and follow counters that differ from the real counts'
+
+    def pending(self):
+        from .models import User, Post
+        return db.session.query(User.id).filter(User.stale_counts()).count() + Post.stale_counts().count()
+
+    def execute(self):
+        from .models import User, Post
+        return User.recount() + Post.recount()
+
+
+@register
+class BuildTimeline(SetBasedJob):
+    name = 'timeline'
+    help = 'Fill the materialized timelines when the table is still empty'
+
+    def pending(self):
+        from .models import Post, Timeline
+        if Timeline.query.first() is not None and not self.restart:
+            return 0
+        return Post.query.count()
+
+    def execute(self):
+        from .models import Timeline
+        Timeline.rebuild()
+        return Timeline.query.count()
+
+
+@register
+class IndexPosts(ChunkedJob):
+    name = 'search_index'
+    help = 'Index every post for full-text search'
+
+    @property
+    def checkpoint_name(self):
+        # 分词规则变了，之前建好的索引不再算数
+        from .search import TOKENIZER_VERSION
+        return '%s.v%d' % (self.name, TOKENIZER_VERSION)
+
+    @property
+    def key(self):
+        from .models import Post
+        return Post.id
+
+    def query(self):
+        from .models import Post
+        return db.session.query(Post.id)
+
+    def process(self, keys):
+        from .models import Post, SearchIndex
+        index = SearchIndex.__table__
+        db.session.execute(index.delete().where(index.c.post_id.in_(keys)))
+        entries = [entry for row in db.session.query(Post.id, Post.body).filter(Post.id.in_(keys))
+                   for entry in SearchIndex.entries(row.id, row.body)]
+        if entries:
+            db.session.execute(index.insert(), entries)
+
+
+# 计数要先于 timeline 修好：关注时按 followers_count 判断大V，页面和 API 也直接显示计数
+DEPLOY_JOBS = ('roles', 'self_follows', 'recount', 'timeline', 'search_index')
+
+
+def run_jobs(names, chunk_size=1000, dry_run=False, restart=False):
+    for name in names:
+        if name not in jobs:
+            raise KeyError('unknown maintenance job %s, one of %s' % (name, ', '.join(jobs)))
+    for name in names:
+        jobs[name](chunk_size=chunk_size, dry_run=dry_run, restart=restart).run()
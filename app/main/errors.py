@@ -1,5 +1,6 @@
 from flask import render_template, request, jsonify
 
+from app.exceptions import PasswordHasherBusy
 from . import main
 
 
@@ -11,6 +12,13 @@ def handle_page_not_find(e):
         return render_template('404.html'), 404
 
 
+@main.app_errorhandler(PasswordHasherBusy)
+def handle_password_hasher_busy(e):
+    if request_wants_json():
+        return jsonify({"status": 503, "error": {"errCode": 503, "errMsg": e.args[0]}}), 503
+    return '服务器繁忙，请稍后再试', 503
+
+
 def request_wants_json():
     best = request.accept_mimetypes \
         .best_match(['application/json', 'text/html'])
@@ -1,15 +1,30 @@
-from flask import render_template, request, flash, abort, url_for, redirect, current_app
+import hmac
+
+from flask import render_template, request, flash, abort, url_for, redirect, current_app, jsonify, Response
 from flask_login import login_required, current_user
-from flask_sqlalchemy import get_debug_queries
 
 from app.decorator import admin_required, permission_required
+from app.follows import follow_graph
+from app.fragments import fragment_cache
+from app.metrics import sql_metrics
+from app.profiler import sampling_profiler, flamegraph
+from app.replicas import read_only, replica_router
 from app.main.forms import EditProfileForm, EditProfileAdminForm, PostForm, CommentForm
-from app.models import Permission, User, Role, Post, Follow, PostType
+from app.models import Permission, User, Role, Post, Follow, PostType, Timeline
+from app.loaders import load_authors, load_replies
+from app.pagination import paginate_keyset, paginate_merged
 from . import main
 from .. import db
 
 
+@main.before_request
+def before_request():
+    if current_user.is_authenticated:
+        current_user.ping()
+
+
 @main.route('/', methods=['POST', 'GET'])
+@read_only
 def home():
     form = PostForm()
     if current_user.can(Permission.POST_ARTICLES) and form.validate_on_submit():
@@ -17,33 +32,36 @@ def home():
         db.session.add(post)
         db.session.commit()
         return redirect(url_for('.home'))
-    page = request.args.get('page', 1, type=int)
-    pagination = Post.query.filter_by(post_type=PostType.POST).order_by(Post.timestamp.desc()) \
-        .paginate(page, per_page=current_app.config['POSTS_PER_PAGE'], error_out=False)
+    pagination = paginate_keyset(Post.query.filter_by(post_type=PostType.POST), [Post.timestamp, Post.id],
+                                 per_page=current_app.config['POSTS_PER_PAGE'])
 
-    posts = pagination.items
+    posts = load_authors(pagination.items)
     return render_template("index.html", form=form, posts=posts, pagination=pagination)
 
 
 @main.route('/post/<int:id>', methods=["GET", "POST"])
+@read_only
 def post(id):
     post = Post.query.get_or_404(id)
-    page = request.args.get('page', 1, type=int)
     form = CommentForm()
     if form.validate_on_submit():
         comment = Post(post_type=PostType.COMMENT, body=form.body.data, parent_post=post,
                        author=current_user._get_current_object(),
                        disabled=not current_user.can(Permission.MODERATE_COMMENTS))
 
+        fragment_cache.invalidate_post(post)
         db.session.add(comment)
         db.session.commit()
-        return redirect(url_for('.post', id=post.id, page=-1))
-    if page == -1:
-        page = (post.comments.count() - 1) // 10 + 1
-
-    pagination = post.comments.order_by(Post.timestamp.asc()).paginate(page, per_page=10, error_out=False)
+        return redirect(url_for('.post', id=post.id, last=1))
+    # page=-1 是旧的"跳到最后一页"链接
+    last = request.args.get('last', 0, type=int) == 1 or request.args.get('page', type=int) == -1
+    pagination = paginate_keyset(post.comments, [Post.timestamp, Post.id], per_page=10, descending=False,
+                                 last=last)
     comments = pagination.items
-    return render_template('post.html', posts=[post], page=page,
+    replies = load_replies(comments, max_depth=current_app.config['THREAD_MAX_DEPTH'],
+                           limit=current_app.config['THREAD_MAX_REPLIES'])
+    load_authors(comments + replies)
+    return render_template('post.html', posts=[post],
                            form=form, comments=comments, pagination=pagination)
 
 
@@ -56,6 +74,7 @@ def edit_post(id):
         abort(403)
 
     if form.validate_on_submit():
+        fragment_cache.invalidate_post(post)
         post.body = form.body.data
         db.session.add(post)
         db.session.commit()
@@ -72,6 +91,7 @@ def delete_post(id):
     if current_user != post.author and \
             not current_user.can(Permission.MODERATE_COMMENTS):
         abort(403)
+    fragment_cache.invalidate_post(post)
     db.session.delete(post)
     db.session.commit()
     flash("The post has been deleted.", "success")
@@ -84,6 +104,7 @@ def moderate(id):
     disabled = request.args.get("disabled")
     if disabled:
         comment = Post.query.get_or_404(id)
+        fragment_cache.invalidate_post(comment)
         if disabled in ('1', '0'):
             comment.disabled = (disabled == '1')
             db.session.add(comment)
@@ -98,15 +119,15 @@ def moderate(id):
 
 
 @main.route('/user/<id>')
+@read_only
 def user(id):
     user = User.query.filter_by(id=id).first()
     if user is None:
         abort(404)
-    page = request.args.get('page', 1, type=int)
-    pagination = user.posts.filter_by(post_type=PostType.POST).order_by(Post.timestamp.desc()) \
-        .paginate(page, per_page=current_app.config['POSTS_PER_PAGE'], error_out=False)
+    pagination = paginate_keyset(user.posts.filter_by(post_type=PostType.POST), [Post.timestamp, Post.id],
+                                 per_page=current_app.config['POSTS_PER_PAGE'])
     total = pagination.total
-    posts = pagination.items
+    posts = load_authors(pagination.items)
     return render_template("user/user.html", user=user, posts=posts, pagination=pagination, total=total)
 
 
@@ -162,6 +183,61 @@ def for_moderators():
     return "FOr moderator"
 
 
+@main.route('/fragment_cache')
+@login_required
+@admin_required
+def fragment_cache_stats():
+    return jsonify(fragment_cache.stats())
+
+
+@main.route('/follow_graph')
+@login_required
+@admin_required
+def follow_graph_stats():
+    stats = follow_graph.stats()
+    if request.args.get('verify', 0, type=int) == 1:
+        stats['stale'] = follow_graph.verify()
+    return jsonify(stats)
+
+
+@main.route('/profiler')
+@login_required
+@admin_required
+def profiler():
+    return jsonify(sampling_profiler.stats())
+
+
+@main.route('/profiler/<action>', methods=['POST'])
+@login_required
+@admin_required
+def profiler_control(action):
+    if action == 'start':
+        sampling_profiler.start()
+    elif action == 'stop':
+        sampling_profiler.stop()
+    elif action == 'reset':
+        sampling_profiler.reset()
+    else:
+        abort(404)
+    return jsonify(sampling_profiler.stats())
+
+
+@main.route('/profiler/collapsed')
+@login_required
+@admin_required
+def profiler_collapsed():
+    return Response(sampling_profiler.collapsed(request.args.get('endpoint')), mimetype='text/plain')
+
+
+@main.route('/profiler/flamegraph')
+@login_required
+@admin_required
+def profiler_flamegraph():
+    endpoint = request.args.get('endpoint')
+    return Response(flamegraph(sampling_profiler.collapsed(endpoint), title=endpoint or 'all endpoints'),
+                    mimetype='image/svg+xml')
+
+
 @main.route('/follow/<int:id>')
 @permission_required(Permission.FOLLOW)
 @login_required
@@ -185,50 +261,71 @@ def unfollow(id):
 
 
 @main.route('/followers/<int:id>')
+@read_only
 def followers(id):
     user = User.query.get_or_404(id)
-    page = request.args.get('page', 1, type=int)
-    pagination = user.followers.order_by(Follow.timestamp.desc()) \
-        .paginate(page, per_page=current_app.config['POSTS_PER_PAGE'], error_out=False)
+    pagination = paginate_keyset(user.followers, [Follow.timestamp, Follow.follower_id],
+                                 per_page=current_app.config['POSTS_PER_PAGE'])
 
     follows = [{'user': item.follower, 'timestamp': item.timestamp} for item in pagination.items]  # 蜜汁写法
+    following = current_user.following_among([follow['user'] for follow in follows]) \
+        if current_user.is_authenticated else set()
 
     return render_template('user/followers.html', user=user, title="跟随者", endpoint='.followers', pagination=pagination,
-                           follows=follows)
+                           follows=follows, following=following)
 
 
 @main.route('/followed_post')
+@read_only
 @login_required
 def followed_posts():
     user = current_user
-    page = request.args.get('page', 1, type=int)
-    pagination = user.followed_posts.order_by(Post.timestamp.desc()) \
-        .paginate(page, per_page=current_app.config['POSTS_PER_PAGE'], error_out=False)
-    posts = pagination.items
+    pagination = paginate_merged(Timeline.branches(user), per_page=current_app.config['POSTS_PER_PAGE'],
+                                 key=Timeline.post_key, load=Timeline.load_posts)
+    posts = load_authors(pagination.items)
     return render_template('followed_posts.html', endpoint='.followed_posts', user=user, pagination=pagination,
                            posts=posts)
 
 
+@main.route('/search')
+@read_only
+def search():
+    q = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int)
+    pagination = Post.search(q).paginate(page, current_app.config['POSTS_PER_PAGE'], error_out=False)
+    posts = load_authors(pagination.items)
+    return render_template('search.html', q=q, posts=posts, pagination=pagination)
+
+
 @main.route('/followed/<int:id>')
+@read_only
 def followed(id):
     user = User.query.get_or_404(id)
-    page = request.args.get('page', 1, type=int)
-    pagination = user.followed.order_by(Follow.timestamp.desc()) \
-        .paginate(page, per_page=current_app.config['POSTS_PER_PAGE'], error_out=False)
+    pagination = paginate_keyset(user.followed, [Follow.timestamp, Follow.followed_id],
+                                 per_page=current_app.config['POSTS_PER_PAGE'])
 
     follows = [{'user': item.followed, 'timestamp': item.timestamp} for item in pagination.items]  # 蜜汁写法
-    return render_template('user/followers.html', user=user, title="关注", endpoint='.followers', pagination=pagination,
-                           follows=follows)
-
-
-@main.after_app_request
-def afeter_request(response):
-    for query in get_debug_queries():
-        if query.duration >= current_app.config['QUERY_DB_TIME_OUT']:
-            current_app.logger.warning('Slow query:%s\n parameters:%s Duration:%fs\n Context:%s\n' %
-                                       (query.statement, query.parameters, query.duration, query.context)
-                                       )
-    return response
+    following = current_user.following_among([follow['user'] for follow in follows]) \
+        if current_user.is_authenticated else set()
+    return render_template('user/followers.html', user=user, title="关注", endpoint='.followed', pagination=pagination,
+                           follows=follows, following=following)
+
+
+def metrics_allowed():
+    """A scraper sending Authorization: Bearer METRICS_TOKEN, or a logged in administrator"""
+    token = current_app.config['METRICS_TOKEN']
+    if token and hmac.compare_digest(request.headers.get('Authorization', '').encode('utf-8'),
+                                     ('Bearer ' + token).encode('utf-8')):
+        return True
+    return current_user.is_authenticated and current_user.is_administrator()
+
+
+@main.route('/metrics')
+def metrics():
+    # 不按 remote_addr 放行：在 nginx 之后所有请求都来自 127.0.0.1
+    if not metrics_allowed():
+        abort(403)
+    return Response(sql_metrics.export() + replica_router.export(), mimetype='text/plain; version=0.0.4')
 
 
 def redirect_url(endpoint='main.home'):
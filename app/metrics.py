@@ -0,0 +1,195 @@
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+app_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+class Histogram:
+    """Prometheus style cumulative histogram, one series per label tuple"""
+
+    def __init__(self, name, help, labels, buckets):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def export(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s histogram' % self.name]
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self.series.items()):
+                label = format_labels(self.labels, labels)
+                for bound, bucket in zip(self.buckets, counts):
+                    lines.append('%s_bucket{%s,le="%s"} %d' % (self.name, label, bound, bucket))
+                lines.append('%s_bucket{%s,le="+Inf"} %d' % (self.name, label, count))
+                lines.append('%s_sum{%s} %f' % (self.name, label, total))
+                lines.append('%s_count{%s} %d' % (self.name, label, count))
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.series = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def inc(self, labels, value=1):
+        with self._lock:
+            self.series[labels] += value
+
+    def export(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s counter' % self.name]
+        with self._lock:
+            for labels, value in sorted(self.series.items()):
+                lines.append('%s{%s} %d' % (self.name, format_labels(self.labels, labels), value))
+        return lines
+
+
+def format_labels(names, values):
+    return ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                    for name, value in zip(names, values))
+
+
+def caller_location():
+    """file:line of the innermost app frame running the current query, template lines included"""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(app_dir) and filename != __file__:
+            template = frame.f_globals.get('__jinja_template__')
+            lineno = template.get_corresponding_lineno(frame.f_lineno) if template is not None else frame.f_lineno
+            return '%s:%d' % (os.path.relpath(filename, os.path.dirname(app_dir)), lineno)
+        frame = frame.f_back
+    return 'unknown'
+
+
+class RequestStats:
+    __slots__ = ('queries', 'db_time', 'statements', 'locations', 'started', 'query_started')
+
+    def __init__(self, sampled):
+        self.queries = 0
+        self.db_time = 0.0
+        # 只有被采样的请求才按语句计数，用来发现 N+1
+        self.statements = defaultdict(int) if sampled else None
+        self.locations = {}
+        self.started = time.perf_counter()
+        self.query_started = None
+
+
+class SQLMetrics:
+    """Per-endpoint SQL metrics collected from engine events, exported by /metrics.
+
+    Every request gets its query count, db time and slow queries recorded, which costs a
+    couple of timer calls per statement. A METRICS_SAMPLE_RATE share of requests also counts
+    identical statements: one repeated METRICS_NPLUSONE_THRESHOLD times is reported as an
+    N+1 pattern, with the template or view line that issued it.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.sample_rate = 0.1
+        self.nplusone_threshold = 5
+        self.slow_query = 0.05
+        self.queries = Histogram('sql_queries_per_request', 'SQL statements per request',
+                                 ('endpoint',), QUERY_BUCKETS)
+        self.db_time = Histogram('sql_seconds_per_request', 'Time spent in SQL per request',
+                                 ('endpoint',), TIME_BUCKETS)
+        self.duration = Histogram('request_duration_seconds', 'Request handling time',
+                                  ('endpoint',), TIME_BUCKETS)
+        self.slow_queries = Counter('sql_slow_queries_total', 'Statements slower than QUERY_DB_TIME_OUT',
+                                    ('endpoint', 'location'))
+        self.nplusone = Counter('sql_nplusone_total', 'Requests repeating one statement (N+1 pattern)',
+                                ('endpoint', 'location'))
+
+    def init_app(self, app):
+        self.app = app
+        self.sample_rate = app.config['METRICS_SAMPLE_RATE']
+        self.nplusone_threshold = app.config['METRICS_NPLUSONE_THRESHOLD']
+        self.slow_query = app.config['QUERY_DB_TIME_OUT']
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        if not event.contains(Engine, 'before_cursor_execute', self.before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', self.before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', self.after_cursor_execute)
+
+    def before_request(self):
+        g.sql_stats = RequestStats(random.random() < self.sample_rate)
+
+    def after_request(self, response):
+        stats = g.pop('sql_stats', None)
+        if stats is None:
+            return response
+        endpoint = (request.endpoint or 'unknown',)
+        self.queries.observe(endpoint, stats.queries)
+        self.db_time.observe(endpoint, stats.db_time)
+        self.duration.observe(endpoint, time.perf_counter() - stats.started)
+        if stats.statements is not None:
+            for statement, count in stats.statements.items():
+                if count >= self.nplusone_threshold:
+                    location = stats.locations.get(statement, 'unknown')
+                    self.nplusone.inc(endpoint + (location,))
+                    self.app.logger.warning('N+1 query on %s: %d times from %s\n%s' %
+                                            (endpoint[0], count, location, statement))
+        return response
+
+    @staticmethod
+    def current():
+        return g.get('sql_stats') if has_request_context() else None
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        stats = self.current()
+        if stats is None:
+            return
+        stats.queries += 1
+        stats.query_started = time.perf_counter()
+        if stats.statements is not None:
+            stats.statements[statement] += 1
+            if stats.statements[statement] == self.nplusone_threshold:
+                stats.locations[statement] = caller_location()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        stats = self.current()
+        if stats is None or stats.query_started is None:
+            return
+        elapsed = time.perf_counter() - stats.query_started
+        stats.db_time += elapsed
+        stats.query_started = None
+        if elapsed >= self.slow_query:
+            location = caller_location()
+            self.slow_queries.inc((request.endpoint or 'unknown', location))
+            self.app.logger.warning('Slow query:%s\n parameters:%s Duration:%fs\n Context:%s\n' %
+                                    (statement, parameters, elapsed, location))
+
+    def export(self):
+        lines = []
+        for metric in (self.queries, self.db_time, self.duration, self.slow_queries, self.nplusone):
+            lines.extend(metric.export())
+        return '\n'.join(lines) + '\n'
+
+
+sql_metrics = SQLMetrics()
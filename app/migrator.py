@@ -0,0 +1,181 @@
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import create_engine, event, func, inspect, select
+
+
+def table_levels(tables):
+    """Group tables so that each only references tables of earlier groups; a group can be copied in parallel"""
+    levels = []
+    remaining = list(tables)
+    while remaining:
+        waiting = {table.name for table in remaining}
+        level = [table for table in remaining
+                 if all(fk.column.table.name == table.name or fk.column.table.name not in waiting
+                        for fk in table.foreign_keys)]
+        if not level:
+            # 外键成环时剩下的表一起复制，靠目标库关闭外键检查
+            level = remaining
+        levels.append(level)
+        remaining = [table for table in remaining if table not in level]
+    return levels
+
+
+def normalize(value):
+    """A value as both databases give it back: MySQL DATETIME keeps no microseconds, FLOAT is single precision"""
+    if isinstance(value, datetime):
+        return value.replace(microsecond=0)
+    if isinstance(value, float):
+        return '%.6g' % value
+    return value
+
+
+def row_digest(row):
+    return int(hashlib.md5(repr(tuple(normalize(value) for value in row)).encode('utf-8')).hexdigest()[:16], 16)
+
+
+class TableResult:
+    __slots__ = ('name', 'rows', 'checksum', 'target_rows', 'target_checksum', 'seconds')
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = 0
+        self.checksum = 0
+        self.target_rows = None
+        self.target_checksum = None
+        self.seconds = 0.0
+
+    @property
+    def ok(self):
+        return self.rows == self.target_rows and self.checksum == self.target_checksum
+
+
+class DataMigrator:
+    """Copy every table of the models from one database to another, e.g. data.sqlite to MySQL.
+
+    Source rows are streamed in primary key order and written with executemany in batches of
+    `batch_size`, which PyMySQL sends as multi-row INSERTs. Tables whose foreign keys are
+    already satisfied are copied in parallel by `workers` threads. Each table gets a row count
+    and an order independent checksum on both sides, so a copy can be verified afterwards.
+    """
+
+    def __init__(self, source_url, target_url, metadata, batch_size=1000, workers=4, truncate=False):
+        self.source = create_engine(source_url)
+        self.target = create_engine(target_url)
+        self.metadata = metadata
+        self.batch_size = batch_size
+        self.workers = workers
+        self.truncate = truncate
+        self.started = time.time()
+        if self.target.dialect.name == 'mysql':
+            event.listen(self.target, 'connect', self.relax_checks)
+
+    @staticmethod
+    def relax_checks(dbapi_connection, connection_record):
+        # 批量导入时关闭外键和唯一性检查，数据来自一个已经满足约束的库
+        cursor = dbapi_connection.cursor()
+        cursor.execute('SET FOREIGN_KEY_CHECKS=0, UNIQUE_CHECKS=0')
+        cursor.close()
+
+    def log(self, message):
+        print('migrate: %s (%.1fs)' % (message, time.time() - self.started))
+
+    def tables(self):
+        """The model tables present in the source, each with the columns the source has"""
+        source_tables = set(inspect(self.source).get_table_names())
+        tables = []
+        for table in self.metadata.sorted_tables:
+            if table.name not in source_tables:
+                self.log('%s: not in the source, skipped' % table.name)
+                continue
+            source_columns = {column['name'] for column in inspect(self.source).get_columns(table.name)}
+            tables.append((table, [column for column in table.columns if column.name in source_columns]))
+        return tables
+
+    def select(self, table, columns):
+        names = {column.name for column in columns}
+        order = [column for column in table.primary_key.columns if column.name in names] or columns
+        return table.select().with_only_columns(columns).order_by(*order)
+
+    def prepare(self, tables):
+        self.metadata.create_all(self.target, tables=[table for table, columns in tables])
+        with self.target.connect() as conn:
+            for table, columns in reversed(tables):
+                count = conn.execute(select([func.count()]).select_from(table)).scalar()
+                if count and not self.truncate:
+                    raise RuntimeError('%s already holds %d rows in the target, pass truncate to replace them'
+                                       % (table.name, count))
+                if count:
+                    conn.execute(table.delete())
+
+    def copy(self, table, columns):
+        result = TableResult(table.name)
+        started = time.time()
+        names = [column.name for column in columns]
+        truncate_seconds = self.target.dialect.name == 'mysql'
+        with self.source.connect() as source, self.target.connect() as target:
+            rows = source.execution_options(stream_results=True).execute(self.select(table, columns))
+            while True:
+                batch = rows.fetchmany(self.batch_size)
+                if not batch:
+                    break
+                values = []
+                for row in batch:
+                    result.checksum += row_digest(row)
+                    row = [normalize(value) if truncate_seconds and isinstance(value, datetime) else value
+                           for value in row]
+                    values.append(dict(zip(names, row)))
+                with target.begin():
+                    target.execute(table.insert(), values)
+                result.rows += len(batch)
+                if result.rows % (self.batch_size * 100) == 0:
+                    self.log('%s: %d rows' % (table.name, result.rows))
+        result.checksum %= 2 ** 64
+        result.seconds = time.time() - started
+        self.log('%s: %d rows copied, %.0f rows/s' % (table.name, result.rows,
+                                                       result.rows / (result.seconds or 1)))
+        return result
+
+    def checksum(self, engine, table, columns):
+        rows = 0
+        checksum = 0
+        with engine.connect() as conn:
+            result = conn.execution_options(stream_results=True).execute(self.select(table, columns))
+            while True:
+                batch = result.fetchmany(self.batch_size)
+                if not batch:
+                    break
+                rows += len(batch)
+                checksum += sum(row_digest(row) for row in batch)
+        return rows, checksum % 2 ** 64
+
+    def verify(self, table, columns, result=None):
+        if result is None:
+            result = TableResult(table.name)
+            result.rows, result.checksum = self.checksum(self.source, table, columns)
+        result.target_rows, result.target_checksum = self.checksum(self.target, table, columns)
+        self.log('%s: %s, %d source rows, %d target rows' % (
+            table.name, 'ok' if result.ok else 'MISMATCH', result.rows, result.target_rows))
+        return result
+
+    def run(self, verify=True):
+        """Copy, then verify, every table; returns the TableResults by table name"""
+        tables = self.tables()
+        self.prepare(tables)
+        columns = dict((table, table_columns) for table, table_columns in tables)
+        results = {}
+        with ThreadPoolExecutor(self.workers) as pool:
+            for level in table_levels([table for table, table_columns in tables]):
+                self.log('copying %s' % ', '.join(table.name for table in level))
+                for result in pool.map(lambda table: self.copy(table, columns[table]), level):
+                    results[result.name] = result
+            if verify:
+                list(pool.map(lambda item: self.verify(item[0], item[1], results[item[0].name]), tables))
+        return results
+
+    def verify_all(self):
+        """Compare the source and target without copying anything"""
+        with ThreadPoolExecutor(self.workers) as pool:
+            return {result.name: result for result in pool.map(lambda item: self.verify(*item), self.tables())}
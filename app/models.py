@@ -1,14 +1,22 @@
 import hashlib
 from datetime import datetime
 
-import bleach
 from flask import current_app, request, url_for
 from flask_login import UserMixin, AnonymousUserMixin
-from itsdangerous import TimedJSONWebSignatureSerializer as Serializer, BadTimeSignature
-from markdown import markdown
-from werkzeug.security import generate_password_hash, check_password_hash
+from itsdangerous import BadTimeSignature
+from sqlalchemy import bindparam, literal, or_
+from sqlalchemy.dialects import mysql
+
+from sqlalchemy.exc import IntegrityError
 
 from app.exceptions import ValidationError
+from app.follows import follow_graph, FollowGraph
+from app.passwords import hash_password, check_password, needs_rehash, credential_cache, credential_key
+from app.identity import get_serializer, invalidate_user, identity_for, clear_cache, \
+    verify_auth_token as verify_token
+from app.presence import last_seen_buffer
+from app.render import render_body, SANITIZER_VERSION
+from app.search import term_weights, query_terms, idf
 from . import db
 from . import login_manager
 
@@ -41,13 +49,33 @@ class Role(db.Model):
             db.session.add(role)
         db.session.commit()
 
+    @staticmethod
+    def on_change_permissions(target, value, old_value, initiator):
+        clear_cache()
+
 
 class Follow(db.Model):
     __tablename__ = 'follow'
     follower_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
-    followed_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    followed_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True, index=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
+    @staticmethod
+    def on_insert(mapper, connection, target):
+        Follow.change_counts(connection, target, 1)
+
+    @staticmethod
+    def on_delete(mapper, connection, target):
+        Follow.change_counts(connection, target, -1)
+
+    @staticmethod
+    def change_counts(connection, target, delta):
+        users = User.__table__
+        connection.execute(users.update().where(users.c.id == target.followed_id)
+                           .values(followers_count=users.c.followers_count + delta))
+        connection.execute(users.update().where(users.c.id == target.follower_id)
+                           .values(followed_count=users.c.followed_count + delta))
+
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
@@ -63,6 +91,12 @@ class User(UserMixin, db.Model):
     member_since = db.Column(db.DateTime(), default=datetime.utcnow)
     last_seen = db.Column(db.DateTime(), default=datetime.utcnow)
     avatar = db.Column(db.String(128))
+    # 大V的帖子不做写扩散，由关注者读取 timeline 时合并
+    fanout_on_read = db.Column(db.Boolean, default=False)
+    # 冗余计数，由 Post/Follow 的事件维护，manage.py recount 可修复偏差
+    posts_count = db.Column(db.Integer, default=0, server_default='0')
+    followers_count = db.Column(db.Integer, default=0, server_default='0')
+    followed_count = db.Column(db.Integer, default=0, server_default='0')
 
     followed = db.relationship('Follow', foreign_keys=[Follow.follower_id],
                                backref=db.backref('follower', lazy='joined'),
@@ -75,19 +109,33 @@ class User(UserMixin, db.Model):
         if not self.is_following(user):
             f = Follow(followed=user, follower=self)
             db.session.add(f)
-            db.session.commit()
+            try:
+                Timeline.backfill(self, user)
+                db.session.commit()
+            except IntegrityError:
+                # 另一个进程已经写入了这条关注，本进程的索引还没过期
+                db.session.rollback()
 
     def unfollow(self, user):
         followed = self.find_following(user)
         if followed is not None:
             db.session.delete(followed)
+            Timeline.trim(self, user)
             db.session.commit()
 
     def find_following(self, user):
         return self.followed.filter_by(followed_id=user.id).first()
 
     def is_following(self, user):
-        return self.find_following(user) is not None
+        if self.id is None or user.id is None:
+            return False
+        return follow_graph.is_following(self.id, user.id)
+
+    def following_among(self, users):
+        """Ids of the given users this user follows"""
+        if self.id is None:
+            return set()
+        return follow_graph.following_among(self.id, [user.id for user in users])
 
     def __init__(self, **kwargs):
         print("User init")
@@ -124,24 +172,64 @@ class User(UserMixin, db.Model):
             except IntegrityError:
                 db.session.rollback()
 
+    @staticmethod
+    def without_self_follow():
+        return db.session.query(User.id).filter(~db.exists().where(db.and_(Follow.follower_id == User.id,
+                                                                          Follow.followed_id == User.id)))
+
     @staticmethod
     def follow_them_self():
-        users = User.query.all()
-        for user in users:
-            if not user.is_following(user):
-                f = Follow(follower=user, followed=user)
-                db.session.add(f)
+        """Add the missing self follows with set-based SQL; returns how many were added"""
+        missing = [row.id for row in User.without_self_follow()]
+        if not missing:
+            return 0
+        users = User.__table__
+        for start in range(0, len(missing), 1000):
+            ids = missing[start:start + 1000]
+            # 不经过 Follow 的 mapper 事件，计数在同一事务里一起更新
+            db.session.execute(users.update().where(users.c.id.in_(ids))
+                               .values(followers_count=users.c.followers_count + 1,
+                                       followed_count=users.c.followed_count + 1))
+            db.session.execute(Follow.__table__.insert().from_select(
+                ['follower_id', 'followed_id', 'timestamp'],
+                db.select([users.c.id, users.c.id.label('followed_id'), users.c.member_since])
+                    .where(users.c.id.in_(ids))))
         db.session.commit()
+        return len(missing)
 
-    @property
-    def followed_posts(self):
-        return Post.query.join(Follow, Follow.followed_id == Post.author_id) \
-            .filter(Follow.follower_id == self.id)
+    @staticmethod
+    def real_counts():
+        """Correlated subqueries of the denormalized counters, by column name"""
+        users = User.__table__
+        return {'posts_count': db.select([db.func.count()]).where(Post.author_id == users.c.id).as_scalar(),
+                'followers_count': db.select([db.func.count()]).where(Follow.followed_id == users.c.id).as_scalar(),
+                'followed_count': db.select([db.func.count()]).where(Follow.follower_id == users.c.id).as_scalar()}
+
+    @staticmethod
+    def stale_counts():
+        """Condition of the users whose stored counters differ from the real counts"""
+        users = User.__table__
+        return or_(*[or_(users.c[name] != count, users.c[name] == None) for name, count in User.real_counts().items()])
+
+    @staticmethod
+    def recount():
+        """Recompute the denormalized counters of the users where they are off, returns how many"""
+        users = User.__table__
+        result = db.session.execute(users.update().where(User.stale_counts()).values(**User.real_counts()))
+        db.session.commit()
+        return result.rowcount
 
     @property
     def comments(self):
         return self.posts.filter_by(post_type=PostType.COMMENT)
 
+    @staticmethod
+    def on_update(mapper, connection, target):
+        state = db.inspect(target)
+        if any(state.attrs[key].history.has_changes()
+               for key in ('role', 'role_id', 'confirmed', 'password_hash', 'username')):
+            invalidate_user(target.id)
+
     @staticmethod
     def on_change_email(target, value, old_value, initiator):
         target.avatar = hashlib.md5(value.encode('utf-8')).hexdigest()
@@ -155,9 +243,12 @@ class User(UserMixin, db.Model):
         return '{url}/{hash}?s={size}&d={default}&r={rating}'.format(
             url=url, hash=hash, default=default, rating=rating, size=size)
 
+    @property
+    def identity(self):
+        return identity_for(self)
+
     def can(self, permissions):
-        return self.role is not None and \
-               (self.role.permissions & permissions) == permissions
+        return self.identity.can(permissions)
 
     def is_administrator(self):
         return self.can(Permission.ADMINISTER)
@@ -168,17 +259,27 @@ class User(UserMixin, db.Model):
 
     @password.setter
     def password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
 
     def verify_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        key = credential_key(self.email, password)
+        if self.password_hash is not None and credential_cache.get(key) == self.password_hash:
+            return True
+        if not check_password(self.password_hash, password):
+            return False
+        if needs_rehash(self.password_hash):
+            self.password = password
+            db.session.add(self)
+            db.session.commit()
+        credential_cache.set(key, self.password_hash, ttl=current_app.config['PASSWORD_CACHE_TTL'])
+        return True
 
     def generate_confirmation_token(self, expiration=3600):
-        s = Serializer(current_app.config['SECRET_KEY'], expiration)
+        s = get_serializer(current_app.config['SECRET_KEY'], expiration)
         return s.dumps({'confirm': self.id})
 
     def generate_auth_token(self, uuid=None, expiration=3600 * 24):
-        s = Serializer(current_app.config['SECRET_KEY'], expiration)
+        s = get_serializer(current_app.config['SECRET_KEY'], expiration)
         rs = s.dumps({'id': self.id, "uuid": uuid})
         if isinstance(rs, bytes):
             rs = rs.decode('utf-8')
@@ -186,18 +287,10 @@ class User(UserMixin, db.Model):
 
     @staticmethod
     def verify_auth_token(token, uuid):
-        s = Serializer(current_app.config['SECRET_KEY'])
-        try:
-            data = s.loads(token)
-            if data.get('uuid') != uuid:
-                raise ValueError("uuid exception")
-        except Exception as e:
-            print(e)
-            return None
-        return User.query.get(data['id'])
+        return verify_token(token, uuid)
 
     def confirm(self, token):
-        s = Serializer(current_app.config['SECRET_KEY'])
+        s = get_serializer(current_app.config['SECRET_KEY'])
         try:
             data = s.loads(token)
             if data.get('confirm') != self.id:
@@ -212,10 +305,7 @@ class User(UserMixin, db.Model):
             return False, 'token 无法识别(%s)' % str(e)
 
     def ping(self):
-        print("save last pin date")
-        self.last_seen = datetime.utcnow()
-        db.session.add(self)
-        db.session.commit()
+        last_seen_buffer.touch(self.id)
 
     def     to_json(self):
         json_post = {'url': url_for('api.get_user', id=self.id, _external=True),
@@ -224,7 +314,7 @@ class User(UserMixin, db.Model):
                      'last_seen': self.last_seen,
                      'posts': url_for('api.get_user_posts', id=self.id, _external=True),
                      'followed_posts': url_for('api.get_user_follows_posts', id=self.id, _external=True),
-                     'posts_count': self.posts.count()
+                     'posts_count': self.posts_count
                      }
         return json_post
 
@@ -239,12 +329,18 @@ class Post(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text)
     body_html = db.Column(db.Text)
+    render_version = db.Column(db.Integer)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
-    author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    # 内容、评论数或审核状态变化时更新，用于 API 的 ETag/Last-Modified
+    last_modified = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    author_id = db.Column(db.Integer, db.ForeignKey('users.id'), index=True)
 
     post_type = db.Column(db.Integer, default=PostType.POST)
-    parent_post_id = db.Column(db.Integer, db.ForeignKey('posts.id'))
+    parent_post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), index=True)
     disabled = db.Column(db.Boolean, default=True)
+    comments_count = db.Column(db.Integer, default=0, server_default='0')
+    # 大V的帖子在关注者读取 timeline 时按作者取最新的一页
+    __table_args__ = (db.Index('ix_posts_author_timestamp', 'author_id', 'timestamp', 'id'),)
 
     comments = db.relationship('Post', foreign_keys=[parent_post_id],
                                backref=db.backref('parent_post',
@@ -266,14 +362,61 @@ class Post(db.Model):
             db.session.add(p)
         db.session.commit()
 
+    @staticmethod
+    def on_insert(mapper, connection, target):
+        Post.change_counts(connection, target.author_id, target.parent_post_id, 1)
+
+    @staticmethod
+    def on_delete(mapper, connection, target):
+        Post.change_counts(connection, target.author_id, target.parent_post_id, -1)
+        # max(id)/max(last_modified) 看不到删除，列表的 ETag 靠这个计数
+        ChangeCounter.bump(connection, 'posts_deleted')
+
+    @staticmethod
+    def on_update(mapper, connection, target):
+        state = db.inspect(target)
+        author = state.attrs.author_id.history
+        parent = state.attrs.parent_post_id.history
+        if author.has_changes() or parent.has_changes():
+            Post.change_counts(connection, (author.deleted or [None])[0], (parent.deleted or [None])[0], -1)
+            Post.change_counts(connection, target.author_id, target.parent_post_id, 1)
+
+    @staticmethod
+    def change_counts(connection, author_id, parent_post_id, delta):
+        users = User.__table__
+        posts = Post.__table__
+        if author_id is not None:
+            connection.execute(users.update().where(users.c.id == author_id)
+                               .values(posts_count=users.c.posts_count + delta))
+        if parent_post_id is not None:
+            connection.execute(posts.update().where(posts.c.id == parent_post_id)
+                               .values(comments_count=posts.c.comments_count + delta))
+
+    @staticmethod
+    def stale_counts():
+        """(id, real comment count) of the posts whose comments_count is off"""
+        posts = Post.__table__
+        children = posts.alias()
+        count = db.select([db.func.count()]).where(children.c.parent_post_id == posts.c.id).as_scalar()
+        return db.session.query(posts.c.id, count) \
+            .filter(or_(posts.c.comments_count != count, posts.c.comments_count == None))
+
+    @staticmethod
+    def recount():
+        """Recompute comments_count of the posts where it is off, returns how many"""
+        posts = Post.__table__
+        # MySQL 不允许 UPDATE posts 的子查询再读 posts（错误 1093），先查出来再按 id 批量更新
+        stale = [{'post_id': id, 'count': count} for id, count in Post.stale_counts()]
+        if stale:
+            db.session.execute(posts.update().where(posts.c.id == bindparam('post_id'))
+                               .values(comments_count=bindparam('count')), stale)
+        db.session.commit()
+        return len(stale)
+
     @staticmethod
     def on_change_body(target, value, old_value, initiator):
-        allowed_tags = ['a', 'b', 'code',
-                        'i', 'li', 'ol', 'pre', 'strong',
-                        'h1', 'h2', 'h3', 'p', 'img', 'br', 'span', 'hr', ]
-        allowed_attrs = {'img': ['alt', 'src'], '*': ['class'], 'a': ['href', 'rel']}
-        target.body_html = bleach.clean(markdown(value, output_format='html'),
-                                        tags=allowed_tags, attributes=allowed_attrs, strip=True)
+        target.body_html = render_body(value)
+        target.render_version = SANITIZER_VERSION
 
     def to_json(self):
         if self.post_type == PostType.POST:
@@ -283,7 +426,7 @@ class Post(db.Model):
                          'timestamp': str(self.timestamp),
                          'author': url_for('api.get_user', id=self.author_id, _external=True),
                          'comments': url_for('api.get_post_comments', id=self.id, _external=True),
-                         'comments_count': self.comments.count()
+                         'comments_count': self.comments_count
                          }
         else:
             json_post = {'url': url_for('api.get_post_comment', parent_id=self.parent_post_id,
@@ -296,7 +439,7 @@ class Post(db.Model):
                              url_for('api.get_post_comment', parent_id=self.parent_post_id, id=self.id),
                          'author': url_for('api.get_user', id=self.author_id, _external=True),
                          'comments': url_for('api.get_post_comments', id=self.id, _external=True),
-                         'comments_count': self.comments.count()
+                         'comments_count': self.comments_count
                          }
 
         return json_post
@@ -308,9 +451,231 @@ class Post(db.Model):
             raise ValidationError('post dosen\'s have body')
         return Post(body=body, post_type=PostType.COMMENT if is_comment else PostType.POST)
 
+    @staticmethod
+    def search(q):
+        """Visible posts and comments matching q, best match first; an empty query matches nothing"""
+        terms = query_terms(q)
+        if not terms:
+            return Post.query.filter(literal(False))
+        total = db.session.query(db.func.count(Post.id)).scalar()
+        dfs = dict(db.session.query(SearchIndex.term, db.func.count())
+                   .filter(SearchIndex.term.in_(terms)).group_by(SearchIndex.term))
+        weights = [(SearchIndex.term == term, idf(total, dfs[term])) for term in terms if term in dfs]
+        if not weights:
+            return Post.query.filter(literal(False))
+        hits = db.session.query(SearchIndex.post_id,
+                                db.func.count().label('matches'),
+                                db.func.sum(SearchIndex.weight * db.case(weights, else_=0)).label('score')) \
+            .filter(SearchIndex.term.in_(terms)).group_by(SearchIndex.post_id).subquery()
+        # 匹配到的词越多越靠前，其次按 tf-idf 得分
+        return Post.query.join(hits, hits.c.post_id == Post.id) \
+            .filter(or_(Post.post_type == PostType.POST, Post.disabled == False)) \
+            .order_by(hits.c.matches.desc(), hits.c.score.desc(), Post.id.desc())
+
+
+class SearchIndex(db.Model):
+    """Inverted index of post bodies: one row per (term, post), kept in sync by the Post mapper events"""
+    __tablename__ = 'search_index'
+    # 按字节比较：即使分词漏掉了某种等价写法，也不会在 MySQL 的默认排序规则下撞主键
+    term = db.Column(db.String(64).with_variant(mysql.VARCHAR(64, collation='utf8mb4_bin'), 'mysql'),
+                     primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), primary_key=True, index=True)
+    weight = db.Column(db.Float)
+
+    @staticmethod
+    def entries(post_id, body):
+        return [{'term': term, 'post_id': post_id, 'weight': weight}
+                for term, weight in term_weights(body).items()]
+
+    @staticmethod
+    def index(connection, post_id, body):
+        connection.execute(SearchIndex.__table__.delete().where(SearchIndex.post_id == post_id))
+        entries = SearchIndex.entries(post_id, body)
+        if entries:
+            connection.execute(SearchIndex.__table__.insert(), entries)
+
+    @staticmethod
+    def on_post_insert(mapper, connection, target):
+        SearchIndex.index(connection, target.id, target.body)
+
+    @staticmethod
+    def on_post_update(mapper, connection, target):
+        if db.inspect(target).attrs.body.history.has_changes():
+            SearchIndex.index(connection, target.id, target.body)
+
+    @staticmethod
+    def on_post_delete(mapper, connection, target):
+        connection.execute(SearchIndex.__table__.delete().where(SearchIndex.post_id == target.id))
+
+
+class Timeline(db.Model):
+    """Materialized home timeline: one row per (follower, post), written when the post is created"""
+    __tablename__ = 'timeline'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), primary_key=True)
+    author_id = db.Column(db.Integer)
+    timestamp = db.Column(db.DateTime)
+    __table_args__ = (db.Index('ix_timeline_user_timestamp', 'user_id', 'timestamp', 'post_id'),)
+
+    @staticmethod
+    def branches(user):
+        """Keyset branches of user's home timeline, as (timestamp, post id) rows: the inbox, a range of
+        ix_timeline_user_timestamp, and one range of ix_posts_author_timestamp per followed hot author"""
+        inbox = db.session.query(Timeline.timestamp, Timeline.post_id).filter(Timeline.user_id == user.id)
+        branches = [(inbox, [Timeline.timestamp, Timeline.post_id])]
+        hot_authors = db.session.query(Follow.followed_id) \
+            .join(User, User.id == Follow.followed_id) \
+            .filter(Follow.follower_id == user.id, User.fanout_on_read == True)
+        # 关注了大V：大V的帖子在读取时合并，每个大V单独按自己的索引取一页
+        for author_id, in hot_authors:
+            posts = db.session.query(Post.timestamp, Post.id).filter(Post.author_id == author_id)
+            branches.append((posts, [Post.timestamp, Post.id]))
+        return branches
+
+    @staticmethod
+    def load_posts(rows):
+        """The posts of (timestamp, post id) rows with one IN query, in the order of rows"""
+        ids = [row[1] for row in rows]
+        posts = {post.id: post for post in Post.query.filter(Post.id.in_(ids))} if ids else {}
+        return [posts[id] for id in ids if id in posts]
+
+    @staticmethod
+    def post_key(post):
+        return [post.timestamp, post.id]
+
+    @staticmethod
+    def on_post_insert(mapper, connection, target):
+        author = connection.execute(db.select([User.fanout_on_read])
+                                    .where(User.id == target.author_id)).first()
+        if author is None or author.fanout_on_read:
+            return
+        followers = db.select([Follow.follower_id, literal(target.id), literal(target.author_id),
+                               literal(target.timestamp, db.DateTime)]) \
+            .where(Follow.followed_id == target.author_id)
+        connection.execute(Timeline.__table__.insert()
+                           .from_select(['user_id', 'post_id', 'author_id', 'timestamp'], followers))
+
+    @staticmethod
+    def on_post_delete(mapper, connection, target):
+        connection.execute(Timeline.__table__.delete().where(Timeline.post_id == target.id))
+
+    @staticmethod
+    def backfill(follower, user):
+        """Copy the most recent posts of user into follower's timeline"""
+        if follower.id is None or user.id is None:
+            return
+        followers_count = db.session.query(User.followers_count).filter(User.id == user.id).scalar()
+        if not user.fanout_on_read and followers_count >= current_app.config['TIMELINE_FANOUT_LIMIT']:
+            user.fanout_on_read = True
+            db.session.add(user)
+        if user.fanout_on_read:
+            return
+        posts = db.select([literal(follower.id), Post.id, Post.author_id, Post.timestamp]) \
+            .where(Post.author_id == user.id) \
+            .order_by(Post.timestamp.desc()) \
+            .limit(current_app.config['TIMELINE_BACKFILL_SIZE'])
+        db.session.execute(Timeline.__table__.insert()
+                           .from_select(['user_id', 'post_id', 'author_id', 'timestamp'], posts))
+
+    @staticmethod
+    def trim(follower, user):
+        db.session.query(Timeline).filter(Timeline.user_id == follower.id, Timeline.author_id == user.id) \
+            .delete(synchronize_session=False)
+
+    @staticmethod
+    def rebuild():
+        """Recompute the fan-out mode of every author and refill all timelines with set-based SQL"""
+        limit = current_app.config['TIMELINE_FANOUT_LIMIT']
+        followers_count = db.select([db.func.count()]).where(Follow.followed_id == User.id).as_scalar()
+        db.session.execute(User.__table__.update().values(fanout_on_read=followers_count >= limit))
+        db.session.execute(Timeline.__table__.delete())
+        posts = db.select([Follow.follower_id, Post.id, Post.author_id, Post.timestamp]) \
+            .select_from(Post.__table__
+                         .join(Follow.__table__, Follow.followed_id == Post.author_id)
+                         .join(User.__table__, User.id == Post.author_id)) \
+            .where(User.fanout_on_read == False)
+        db.session.execute(Timeline.__table__.insert()
+                           .from_select(['user_id', 'post_id', 'author_id', 'timestamp'], posts))
+        db.session.commit()
+
+
+class JobCheckpoint(db.Model):
+    """Progress of a manage.py maintenance job, chunked jobs resume after last_key"""
+    __tablename__ = 'maintenance_jobs'
+    name = db.Column(db.String(64), primary_key=True)
+    last_key = db.Column(db.Integer)
+    processed = db.Column(db.Integer, default=0)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+
+class ChangeCounter(db.Model):
+    """Named counters bumped from mapper events, for changes an aggregate cannot see (deletes)"""
+    __tablename__ = 'change_counters'
+    name = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.Integer, default=0)
+    updated_at = db.Column(db.DateTime)
+
+    @staticmethod
+    def bump(connection, name):
+        counters = ChangeCounter.__table__
+        now = datetime.utcnow()
+        if not connection.execute(counters.update().where(counters.c.name == name)
+                                  .values(value=counters.c.value + 1, updated_at=now)).rowcount:
+            connection.execute(counters.insert().values(name=name, value=1, updated_at=now))
+
+    @staticmethod
+    def get(name):
+        """(value, updated_at) of a counter, (0, None) before its first bump"""
+        row = db.session.query(ChangeCounter.value, ChangeCounter.updated_at) \
+            .filter(ChangeCounter.name == name).first()
+        return (row.value, row.updated_at) if row is not None else (0, None)
+
+
+class MailStatus:
+    PENDING = 0x01
+    SENDING = 0x02
+    SENT = 0x03
+    FAILED = 0x04
+
+
+class OutgoingMail(db.Model):
+    """Durable mail outbox, drained by the manage.py mailworker pool"""
+    __tablename__ = 'mail_outbox'
+    id = db.Column(db.Integer, primary_key=True)
+    sender = db.Column(db.String(128))
+    recipient = db.Column(db.String(64))
+    subject = db.Column(db.String(256))
+    body = db.Column(db.Text)
+    html = db.Column(db.Text)
+    status = db.Column(db.Integer, default=MailStatus.PENDING)
+    # 待发送/重试的时间，发送中的邮件则是租约到期时间，worker 崩溃后可被重新领取
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    attempts = db.Column(db.Integer, default=0)
+    claim = db.Column(db.String(32), index=True)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    __table_args__ = (db.Index('ix_mail_outbox_status_next', 'status', 'next_attempt_at'),)
+
 
 db.event.listen(Post.body, 'set', Post.on_change_body)
+db.event.listen(Post, 'after_insert', Timeline.on_post_insert)
+db.event.listen(Post, 'before_delete', Timeline.on_post_delete)
+db.event.listen(Post, 'after_insert', Post.on_insert)
+db.event.listen(Post, 'after_delete', Post.on_delete)
+db.event.listen(Post, 'after_update', Post.on_update)
+db.event.listen(Post, 'after_insert', SearchIndex.on_post_insert)
+db.event.listen(Post, 'after_update', SearchIndex.on_post_update)
+db.event.listen(Post, 'before_delete', SearchIndex.on_post_delete)
+db.event.listen(Follow, 'after_insert', Follow.on_insert)
+db.event.listen(Follow, 'after_delete', Follow.on_delete)
+db.event.listen(Follow, 'after_insert', FollowGraph.on_follow_insert)
+db.event.listen(Follow, 'after_delete', FollowGraph.on_follow_delete)
 db.event.listen(User.email, 'set', User.on_change_email)
+db.event.listen(User, 'after_update', User.on_update)
+db.event.listen(Role.permissions, 'set', Role.on_change_permissions)
 
 
 class AnonymousUser(AnonymousUserMixin):
@@ -334,4 +699,4 @@ class Permission:
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return User.query.options(db.joinedload(User.role)).filter_by(id=int(user_id)).first()
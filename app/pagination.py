@@ -0,0 +1,182 @@
+import base64
+import json
+from datetime import datetime
+
+from flask import request
+from sqlalchemy import and_, or_
+
+CURSOR_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def encode_cursor(values, backwards=False):
+    """Encode the sort key of a row as an opaque, url safe cursor"""
+    keys = []
+    for value in values:
+        if isinstance(value, datetime):
+            keys.append({'dt': value.strftime(CURSOR_DATETIME_FORMAT)})
+        else:
+            keys.append(value)
+    raw = json.dumps({'k': keys, 'b': 1 if backwards else 0}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (values, backwards), or (None, False) for an unknown cursor"""
+    if not cursor:
+        return None, False
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        values = []
+        for key in data['k']:
+            if isinstance(key, dict):
+                key = datetime.strptime(key['dt'], CURSOR_DATETIME_FORMAT)
+            values.append(key)
+        return values, bool(data.get('b'))
+    except (ValueError, KeyError, TypeError):
+        return None, False
+
+
+def _after(columns, values, descending):
+    """(c1, c2, ...) strictly after values, expanded because sqlite/mysql row values are unreliable"""
+    clauses = []
+    for i, column in enumerate(columns):
+        equals = [columns[j] == values[j] for j in range(i)]
+        step = column < values[i] if descending else column > values[i]
+        clauses.append(and_(*(equals + [step])))
+    return or_(*clauses)
+
+
+def _matches(column, value):
+    """Whether a cursor value has the type of its column, a tampered cursor starts over"""
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return True
+    if python_type is float:
+        python_type = (int, float)
+    return isinstance(value, python_type) and (python_type is bool or not isinstance(value, bool))
+
+
+class KeysetPagination:
+    """Keyset (cursor) pagination, no OFFSET and no COUNT(*) unless asked for.
+
+    Mirrors flask_sqlalchemy's Pagination (items/has_next/has_prev/total) but pages are
+    reached through next_cursor/prev_cursor instead of page numbers.
+    """
+
+    def __init__(self, query, columns, cursor=None, per_page=10, descending=True,
+                 last=False, count=False, key=None):
+        self.query = query
+        self.columns = columns
+        self.per_page = per_page
+        self.descending = descending
+        self.key = key or (lambda item: [getattr(item, c.key) for c in columns])
+        self.total = self.count() if count else None
+
+        values, backwards = decode_cursor(cursor)
+        if last and values is None:
+            backwards = True
+        # 向前翻页时反向排序取数据，再把结果翻转回来
+        reverse = descending != backwards
+        if values is None or len(values) != len(columns) or \
+                not all(_matches(column, value) for column, value in zip(columns, values)):
+            values = None
+        rows = self.fetch(values, reverse, per_page + 1)
+        more = len(rows) > per_page
+        rows = rows[:per_page]
+        if backwards:
+            rows.reverse()
+            self.has_prev = more
+            self.has_next = values is not None
+        else:
+            self.has_next = more
+            self.has_prev = values is not None
+        self.items = self.load(rows)
+
+    def count(self):
+        return self.query.order_by(None).count()
+
+    @staticmethod
+    def page(query, columns, values, reverse):
+        """query after values in the order of columns, without LIMIT"""
+        q = query.order_by(None)
+        if values is not None:
+            q = q.filter(_after(columns, values, reverse))
+        return q.order_by(*[c.desc() if reverse else c.asc() for c in columns])
+
+    def fetch(self, values, reverse, limit):
+        return self.page(self.query, self.columns, values, reverse).limit(limit).all()
+
+    def load(self, rows):
+        return rows
+
+    @property
+    def next_cursor(self):
+        if not self.has_next or not self.items:
+            return None
+        return encode_cursor(self.key(self.items[-1]))
+
+    @property
+    def prev_cursor(self):
+        if not self.has_prev or not self.items:
+            return None
+        return encode_cursor(self.key(self.items[0]), backwards=True)
+
+
+class MergedKeysetPagination(KeysetPagination):
+    """KeysetPagination over several queries whose sort keys have the same shape.
+
+    branches is a list of (query, columns). Each branch gets its own keyset filter, ORDER BY and
+    LIMIT, so each stays an index range scan; the pages are merged here and rows with equal keys
+    are kept once. load(rows) turns the merged key rows into the items, key(item) gives the
+    key of an item back.
+    """
+
+    def __init__(self, branches, cursor=None, per_page=10, descending=True, last=False, count=False,
+                 key=None, load=None):
+        self.branches = branches
+        self.load_rows = load or list
+        query, columns = branches[0]
+        KeysetPagination.__init__(self, query, columns, cursor=cursor, per_page=per_page,
+                                  descending=descending, last=last, count=count, key=key)
+
+    def count(self):
+        queries = [query.order_by(None) for query, columns in self.branches]
+        return queries[0].union(*queries[1:]).count()
+
+    def fetch(self, values, reverse, limit):
+        rows = {}
+        for query, columns in self.branches:
+            for row in self.page(query, columns, values, reverse).limit(limit):
+                rows.setdefault(tuple(row), row)
+        return [rows[key] for key in sorted(rows, reverse=reverse)[:limit]]
+
+    def load(self, rows):
+        return self.load_rows(rows)
+
+
+def paginate_keyset(query, columns, per_page, descending=True, count=False, last=None, key=None):
+    """Build a KeysetPagination from the cursor/last arguments of the current request"""
+    if last is None:
+        last = request.args.get('last', 0, type=int) == 1
+    return KeysetPagination(query, columns,
+                            cursor=request.args.get('cursor'),
+                            per_page=per_page,
+                            descending=descending,
+                            last=last,
+                            count=count,
+                            key=key)
+
+
+def paginate_merged(branches, per_page, key, load, descending=True, last=None):
+    """Build a MergedKeysetPagination from the cursor/last arguments of the current request"""
+    if last is None:
+        last = request.args.get('last', 0, type=int) == 1
+    return MergedKeysetPagination(branches,
+                                  cursor=request.args.get('cursor'),
+                                  per_page=per_page,
+                                  descending=descending,
+                                  last=last,
+                                  key=key,
+                                  load=load)
@@ -0,0 +1,67 @@
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app, has_app_context
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from .cache import LRUCache
+from .exceptions import PasswordHasherBusy
+
+DEFAULT_METHOD = 'pbkdf2:sha256:150000'
+
+credential_cache = LRUCache(maxsize=10000)
+_pool = None
+_pool_pid = None
+_slots = None
+_lock = threading.Lock()
+
+
+def _config(key, default=None):
+    return current_app.config.get(key, default) if has_app_context() else default
+
+
+def _executor():
+    """One pool per process, created lazily so forked workers don't share it"""
+    global _pool, _pool_pid, _slots
+    with _lock:
+        if _pool is None or _pool_pid != os.getpid():
+            workers = _config('PASSWORD_HASH_WORKERS')
+            _pool = ProcessPoolExecutor(workers)
+            _pool_pid = os.getpid()
+            _slots = threading.BoundedSemaphore(workers + _config('PASSWORD_HASH_QUEUE', 0))
+        return _pool, _slots
+
+
+def _run(fn, *args):
+    if not _config('PASSWORD_HASH_WORKERS'):
+        return fn(*args)
+    pool, slots = _executor()
+    if not slots.acquire(timeout=_config('PASSWORD_HASH_TIMEOUT', 5)):
+        raise PasswordHasherBusy('too many password hashing requests')
+    try:
+        return pool.submit(fn, *args).result()
+    finally:
+        slots.release()
+
+
+def hash_password(password):
+    return _run(generate_password_hash, password, _config('PASSWORD_HASH_METHOD', DEFAULT_METHOD))
+
+
+def check_password(password_hash, password):
+    return _run(check_password_hash, password_hash, password)
+
+
+def needs_rehash(password_hash):
+    method = password_hash.split('$', 1)[0]
+    return method != _config('PASSWORD_HASH_METHOD', DEFAULT_METHOD)
+
+
+def credential_key(email, password):
+    """Keyed digest of a credential pair, the plain password never ends up in the cache"""
+    secret = (_config('SECRET_KEY') or '').encode('utf-8')
+    message = ('%s\0%s' % (email, password)).encode('utf-8')
+    return hmac.new(secret, message, hashlib.sha256).hexdigest()
@@ -0,0 +1,90 @@
+import atexit
+import os
+import threading
+from datetime import datetime
+
+from sqlalchemy import bindparam
+
+from .cache import LRUCache
+
+
+class LastSeenBuffer:
+    """Coalesces User.last_seen updates in memory and writes them with one bulk UPDATE.
+
+    A user is queued at most once per `resolution` seconds; the queue is flushed when it
+    holds `flush_size` users, and every `flush_interval` seconds by a background thread so
+    an idle process still writes what it buffered.
+    """
+
+    def __init__(self, resolution=60, flush_interval=30, flush_size=200):
+        self.app = None
+        self.resolution = resolution
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self._recent = LRUCache(maxsize=100000, ttl=resolution)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+
+    def init_app(self, app):
+        self.app = app
+        self.resolution = app.config['LAST_SEEN_RESOLUTION']
+        self.flush_interval = app.config['LAST_SEEN_FLUSH_INTERVAL']
+        self.flush_size = app.config['LAST_SEEN_FLUSH_SIZE']
+        self._recent = LRUCache(maxsize=100000, ttl=self.resolution)
+        atexit.register(self.flush)
+
+    def touch(self, user_id):
+        if user_id is None or self._recent.get(user_id) is not None:
+            return
+        self._recent.set(user_id, True)
+        if not self.running:
+            # 和采样分析器一样在第一次使用时启动，fork 出的 worker 各自有刷新线程
+            self.start()
+        with self._lock:
+            self._pending[user_id] = datetime.utcnow()
+            due = len(self._pending) >= self.flush_size
+        if due:
+            self.flush()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive() and self._pid == os.getpid()
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return
+            self._stop.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='last-seen-flusher', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception('Flushing last_seen failed')
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending or self.app is None:
+            return
+        from . import db
+        from .models import User
+        users = User.__table__
+        # 直接用 engine，不压入新的 app context：在请求中弹出它会触发 teardown 移除当前请求的 session
+        with db.get_engine(self.app).begin() as connection:
+            connection.execute(users.update().where(users.c.id == bindparam('user_id'))
+                               .values(last_seen=bindparam('seen')),
+                               [{'user_id': user_id, 'seen': seen} for user_id, seen in pending.items()])
+
+
+last_seen_buffer = LastSeenBuffer()
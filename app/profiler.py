@@ -0,0 +1,170 @@
+import os
+import sys
+import threading
+import zlib
+from collections import defaultdict
+
+from flask import request
+from markupsafe import escape
+
+
+class SamplingProfiler:
+    """Statistical profiler: a background thread samples the stacks of the threads that are
+    serving a request every `interval` seconds and counts them per endpoint.
+
+    Unlike ProfilerMiddleware nothing is traced, so the cost is one stack walk per busy
+    thread per interval, and it can be switched on and off in a running process.
+    """
+
+    def __init__(self, interval=0.01, max_stacks=20000):
+        self.enabled = False
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.stacks = defaultdict(int)
+        self.samples = 0
+        self.dropped = 0
+        # thread ident -> endpoint of the request the thread is serving
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+
+    def init_app(self, app):
+        self.enabled = app.config['PROFILER_ENABLED']
+        self.interval = app.config['PROFILER_INTERVAL']
+        self.max_stacks = app.config['PROFILER_MAX_STACKS']
+        app.before_request(self.before_request)
+        app.teardown_request(self.teardown_request)
+
+    def before_request(self):
+        if not self.enabled:
+            return
+        if not self.running:
+            # 在请求中启动，gunicorn 等预加载后 fork 出的 worker 各自有采样线程
+            self.start()
+        self._active[threading.get_ident()] = request.endpoint or 'unknown'
+
+    def teardown_request(self, exc=None):
+        self._active.pop(threading.get_ident(), None)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive() and self._pid == os.getpid()
+
+    def start(self):
+        with self._lock:
+            self.enabled = True
+            if self.running:
+                return
+            self._stop.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self.enabled = False
+        self._stop.set()
+        self._active.clear()
+
+    def reset(self):
+        with self._lock:
+            self.stacks.clear()
+            self.samples = 0
+            self.dropped = 0
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for ident, endpoint in list(self._active.items()):
+                frame = frames.get(ident)
+                if frame is None or ident == me:
+                    continue
+                key = '%s;%s' % (endpoint, collapse(frame))
+                with self._lock:
+                    self.samples += 1
+                    if key in self.stacks or len(self.stacks) < self.max_stacks:
+                        self.stacks[key] += 1
+                    else:
+                        self.dropped += 1
+
+    def collapsed(self, endpoint=None):
+        """Stacks in the collapsed format of flamegraph.pl / speedscope, one 'a;b;c count' per line"""
+        with self._lock:
+            items = sorted(self.stacks.items())
+        if endpoint:
+            items = [(stack, count) for stack, count in items if stack.split(';', 1)[0] == endpoint]
+        return ''.join('%s %d\n' % item for item in items)
+
+    def stats(self):
+        with self._lock:
+            endpoints = defaultdict(int)
+            for stack, count in self.stacks.items():
+                endpoints[stack.split(';', 1)[0]] += count
+            return {'enabled': self.enabled, 'running': self.running, 'interval': self.interval,
+                    'samples': self.samples, 'dropped': self.dropped, 'stacks': len(self.stacks),
+                    'endpoints': dict(endpoints)}
+
+
+def frame_name(frame):
+    code = frame.f_code
+    template = frame.f_globals.get('__jinja_template__')
+    if template is not None:
+        return 'template:%s' % template.name
+    return '%s.%s' % (frame.f_globals.get('__name__', os.path.basename(code.co_filename)), code.co_name)
+
+
+def collapse(frame):
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def flamegraph(collapsed, width=1200, row_height=16, title='Flame graph'):
+    """Render collapsed stacks as a standalone SVG flame graph, hover a frame for its samples"""
+    root = [0, {}]
+    for line in collapsed.splitlines():
+        stack, _, count = line.rpartition(' ')
+        count = int(count)
+        root[0] += count
+        node = root
+        for name in stack.split(';'):
+            node = node[1].setdefault(name, [0, {}])
+            node[0] += count
+    rects = []
+    depth = [0]
+
+    def layout(children, x, level):
+        depth[0] = max(depth[0], level + 1)
+        for name, (count, grandchildren) in sorted(children.items()):
+            w = width * count / root[0]
+            if w >= 0.5:
+                rects.append((name, count, x, level, w))
+                layout(grandchildren, x, level + 1)
+            x += w
+
+    if root[0]:
+        layout(root[1], 0.0, 0)
+    height = (depth[0] + 2) * row_height
+    out = ['<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" font-family="monospace" '
+           'font-size="11">' % (width, height),
+           '<text x="4" y="%d">%s, %d samples</text>' % (row_height - 4, escape(title), root[0])]
+    for name, count, x, level, w in rects:
+        y = height - (level + 1) * row_height
+        hue = zlib.crc32(name.encode('utf-8')) % 60
+        label = '%s (%d samples, %.1f%%)' % (name, count, 100.0 * count / root[0])
+        out.append('<g><title>%s</title><rect x="%.1f" y="%d" width="%.1f" height="%d" '
+                   'fill="hsl(%d,80%%,60%%)" stroke="white" stroke-width="0.5"/>' %
+                   (escape(label), x, y, w, row_height - 1, hue))
+        if w > 40:
+            out.append('<text x="%.1f" y="%d">%s</text>' % (x + 2, y + row_height - 4,
+                                                            escape(name[:int(w / 7)])))
+        out.append('</g>')
+    out.append('</svg>')
+    return '\n'.join(out)
+
+
+sampling_profiler = SamplingProfiler()
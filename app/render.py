@@ -0,0 +1,71 @@
+import hashlib
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import bleach
+from markdown import markdown
+
+from .cache import LRUCache
+
+ALLOWED_TAGS = ['a', 'b', 'code',
+                'i', 'li', 'ol', 'pre', 'strong',
+                'h1', 'h2', 'h3', 'p', 'img', 'br', 'span', 'hr', ]
+ALLOWED_ATTRS = {'img': ['alt', 'src'], '*': ['class'], 'a': ['href', 'rel']}
+# 修改上面的白名单后需要加一，缓存和已保存的 body_html 都会按新版本重新渲染
+SANITIZER_VERSION = 1
+
+render_cache = LRUCache(maxsize=2048)
+
+
+def render_markdown(body):
+    """Markdown to sanitized html, no cache; module level so it can run in a process pool"""
+    return bleach.clean(markdown(body or '', output_format='html'),
+                        tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRS, strip=True)
+
+
+def render_body(body):
+    key = '%d:%s' % (SANITIZER_VERSION, hashlib.sha1((body or '').encode('utf-8')).hexdigest())
+    html = render_cache.get(key)
+    if html is None:
+        html = render_markdown(body)
+        render_cache.set(key, html)
+    return html
+
+
+def rerender_posts(workers=4, chunk_size=500):
+    """Re-render every post whose body_html was produced by an older sanitizer version.
+
+    Posts are streamed in id order and committed chunk by chunk, so an interrupted run
+    picks up where it stopped the next time it is started.
+    """
+    from . import db
+    from .models import Post
+    stale = db.or_(Post.render_version != SANITIZER_VERSION, Post.render_version == None)
+    total = Post.query.filter(stale).count()
+    done = 0
+    last_id = 0
+    started = time.time()
+    pool = ProcessPoolExecutor(workers) if workers > 1 else None
+    try:
+        while True:
+            rows = db.session.query(Post.id, Post.body).filter(stale, Post.id > last_id) \
+                .order_by(Post.id).limit(chunk_size).all()
+            if not rows:
+                break
+            bodies = [row.body for row in rows]
+            if pool is not None:
+                htmls = pool.map(render_markdown, bodies, chunksize=max(1, len(bodies) // (workers * 4)))
+            else:
+                htmls = map(render_markdown, bodies)
+            db.session.bulk_update_mappings(Post, [{'id': row.id, 'body_html': html,
+                                                    'render_version': SANITIZER_VERSION}
+                                                   for row, html in zip(rows, htmls)])
+            db.session.commit()
+            last_id = rows[-1].id
+            done += len(rows)
+            elapsed = time.time() - started
+            print('rerender: %d/%d posts, last id %d, %.1f posts/s' % (done, total, last_id, done / (elapsed or 1)))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return done
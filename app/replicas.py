@@ -0,0 +1,163 @@
+import random
+import time
+
+from flask import current_app, g, has_request_context, request, session as cookie_session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.orm import Session, sessionmaker
+
+from .cache import LRUCache
+from .metrics import Counter, format_labels
+
+READ_METHODS = ('GET', 'HEAD')
+
+
+def read_only(f):
+    """Mark a view whose GET requests may be answered from a read replica"""
+    f.read_only = True
+    return f
+
+
+def pool_options(config):
+    return {'pool_size': config['DB_POOL_SIZE'], 'max_overflow': config['DB_MAX_OVERFLOW'],
+            'pool_recycle': config['DB_POOL_RECYCLE'], 'pool_timeout': config['DB_POOL_TIMEOUT']}
+
+
+def ping(dbapi_connection, connection_record, connection_proxy):
+    # 取出连接时先探测一下，连接已断开则让连接池换一个新连接
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute('SELECT 1')
+    except Exception:
+        raise exc.DisconnectionError()
+    finally:
+        cursor.close()
+
+
+class RoutingSession(SignallingSession):
+    """Session that reads from a replica when replica_router allows it; flushes always go to the primary"""
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing:
+            engine = replica_router.engine_for_read()
+            if engine is not None:
+                return engine
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy with RoutingSession and the DB_POOL_* settings applied to server databases"""
+
+    def create_session(self, options):
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        rv = super(RoutingSQLAlchemy, self).apply_driver_hacks(app, sa_url, options)
+        if not sa_url.drivername.startswith('sqlite'):
+            options.update(pool_options(app.config))
+        return rv
+
+
+class ReplicaRouter:
+    """Sends the GET requests of @read_only views to one of SQLALCHEMY_REPLICA_URIS.
+
+    Everything else uses the primary: other methods and views, the rest of a request once it
+    flushed a write, and for DB_REPLICA_STICKY_SECONDS after a commit the requests of the same
+    browser session or API user, so that they read their own writes despite replication lag.
+    """
+
+    def __init__(self):
+        self.engines = []
+        self.pre_ping = False
+        self.sticky = 5
+        self.recent_writers = LRUCache(maxsize=100000, ttl=self.sticky)
+        self.routed = Counter('db_replica_requests_total', 'Requests whose reads went to a replica',
+                              ('replica',))
+
+    def init_app(self, app):
+        self.sticky = app.config['DB_REPLICA_STICKY_SECONDS']
+        self.recent_writers = LRUCache(maxsize=100000, ttl=self.sticky)
+        self.engines = [create_engine(uri, **({} if uri.startswith('sqlite') else pool_options(app.config)))
+                        for uri in app.config['SQLALCHEMY_REPLICA_URIS']]
+        self.pre_ping = app.config['DB_POOL_PRE_PING']
+        for engine in self.engines:
+            self.watch(engine)
+        app.before_request(self.before_request)
+
+    def watch(self, engine):
+        """Ping the connections of engine's pool on checkout, only this app's pools get the extra SELECT 1"""
+        if self.pre_ping and not event.contains(engine.pool, 'checkout', ping):
+            event.listen(engine.pool, 'checkout', ping)
+
+    def before_request(self):
+        from . import db
+        # 主库的 engine 由 Flask-SQLAlchemy 按需创建（连接串变了会重建），在请求开始时挂上探测
+        self.watch(db.engine)
+        for key in ('db_primary', 'db_wrote', 'db_replica'):
+            g.pop(key, None)
+
+    @staticmethod
+    def identity(user):
+        # g.current_user 可能是 User，也可能是 token 认证得到的 Identity，两者都有 id
+        if user is None or getattr(user, 'is_anonymous', True):
+            return None
+        return getattr(user, 'id', None)
+
+    def sticks_to_primary(self):
+        if cookie_session.get('db_primary_until', 0) > time.time():
+            return True
+        identity = self.identity(g.get('current_user'))
+        return identity is not None and self.recent_writers.get(identity) is not None
+
+    def engine_for_read(self):
+        if not self.engines or not has_request_context() or request.method not in READ_METHODS:
+            return None
+        view = current_app.view_functions.get(request.endpoint)
+        if not getattr(view, 'read_only', False) or g.get('db_primary') or self.sticks_to_primary():
+            return None
+        # 一个请求内的读取都用同一个副本
+        index = g.get('db_replica')
+        if index is None:
+            index = g.db_replica = random.randrange(len(self.engines))
+            self.routed.inc(('replica%d' % index,))
+        return self.engines[index]
+
+    def engines_by_name(self):
+        from . import db
+        return [('primary', db.engine)] + [('replica%d' % i, engine) for i, engine in enumerate(self.engines)]
+
+    def export(self):
+        """Connection pool gauges and routing counters in the Prometheus text format"""
+        lines = ['# HELP db_pool_connections Connections of each pool by state',
+                 '# TYPE db_pool_connections gauge']
+        for name, engine in self.engines_by_name():
+            pool = engine.pool
+            # SQLite 的 NullPool/StaticPool 没有这些统计
+            if not hasattr(pool, 'checkedout'):
+                continue
+            for state, value in (('size', pool.size()), ('checked_in', pool.checkedin()),
+                                 ('checked_out', pool.checkedout()), ('overflow', pool.overflow())):
+                lines.append('db_pool_connections{%s} %d' % (format_labels(('bind', 'state'), (name, state)), value))
+        lines.extend(self.routed.export())
+        return '\n'.join(lines) + '\n'
+
+
+# 写入之后本请求余下的读取走主库，提交后在 DB_REPLICA_STICKY_SECONDS 内继续走主库
+@event.listens_for(Session, 'after_flush')
+def note_write(session, flush_context):
+    if has_request_context():
+        g.db_primary = True
+        g.db_wrote = True
+
+
+@event.listens_for(Session, 'after_commit')
+def stick_to_primary(session):
+    if not has_request_context() or not g.pop('db_wrote', False) or not replica_router.engines:
+        return
+    cookie_session['db_primary_until'] = time.time() + replica_router.sticky
+    identity = replica_router.identity(g.get('current_user'))
+    if identity is not None:
+        replica_router.recent_writers.set(identity, True)
+
+
+replica_router = ReplicaRouter()
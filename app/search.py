@@ -0,0 +1,81 @@
+import math
+import re
+import time
+import unicodedata
+from collections import Counter
+
+# 中日韩文字没有空格分词，按单字和相邻两字（bigram）建索引
+CJK = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff'
+TOKEN_RE = re.compile('([%s]+)|([^\\W_%s]+)' % (CJK, CJK))
+MAX_TERM_LENGTH = 64
+# 分词规则变化时加一，manage.py deploy 会重建索引
+TOKENIZER_VERSION = 2
+
+
+def fold(word):
+    """word without accents, e.g. café -> cafe"""
+    decomposed = unicodedata.normalize('NFKD', word)
+    return unicodedata.normalize('NFC', ''.join(c for c in decomposed if not unicodedata.combining(c)))
+
+
+def tokenize(text, unigrams=True):
+    """Lowercased, accent and width folded words of latin text, unigrams and bigrams of CJK runs.
+
+    Queries pass unigrams=False: a CJK run of two or more characters is then only matched
+    by its bigrams, so "天气" doesn't find every post containing "天".
+    """
+    tokens = []
+    # MySQL 默认的排序规则不区分重音和全半角，café 和 cafe 在主键上是同一个词，这里先统一
+    for cjk, word in TOKEN_RE.findall(unicodedata.normalize('NFKC', text or '').lower()):
+        if word:
+            word = fold(word)
+            if len(word) <= MAX_TERM_LENGTH:
+                tokens.append(word)
+            continue
+        if unigrams or len(cjk) == 1:
+            tokens.extend(cjk)
+        tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+    return tokens
+
+
+def term_weights(text):
+    """term -> tf normalized by document length, what the index stores per (term, post)"""
+    tokens = tokenize(text)
+    if not tokens:
+        return {}
+    norm = math.sqrt(len(tokens))
+    return {term: tf / norm for term, tf in Counter(tokens).items()}
+
+
+def query_terms(q):
+    return sorted(set(tokenize(q, unigrams=False)))
+
+
+def idf(total, df):
+    return math.log(1 + total / df) if df else 0.0
+
+
+def rebuild_index(chunk_size=1000):
+    """Drop the whole inverted index and rebuild it from posts, in id order, one commit per chunk"""
+    from . import db
+    from .models import Post, SearchIndex
+    db.session.execute(SearchIndex.__table__.delete())
+    db.session.commit()
+    total = Post.query.count()
+    done = 0
+    last_id = 0
+    started = time.time()
+    while True:
+        rows = db.session.query(Post.id, Post.body).filter(Post.id > last_id) \
+            .order_by(Post.id).limit(chunk_size).all()
+        if not rows:
+            break
+        entries = [entry for row in rows for entry in SearchIndex.entries(row.id, row.body)]
+        if entries:
+            db.session.execute(SearchIndex.__table__.insert(), entries)
+        db.session.commit()
+        last_id = rows[-1].id
+        done += len(rows)
+        elapsed = time.time() - started
+        print('reindex: %d/%d posts, last id %d, %.1f posts/s' % (done, total, last_id, done / (elapsed or 1)))
+    return done
@@ -0,0 +1,195 @@
+import hashlib
+import random
+import time
+from array import array
+from bisect import bisect
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+from .render import SANITIZER_VERSION
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore '
+         'et dolore magna aliqua python flask mysql sqlite cache index query timeline follow comment '
+         '今天 天气 很好 我们 一起 学习 数据库 性能 优化 周末 电影 音乐 旅行 城市 朋友 工作 生活').split()
+SEED_PASSWORD = 'password'
+# 粉丝数/发帖量的幂律指数，越大越集中在少数大V身上
+SKEW = 1.1
+
+
+class Seeder:
+    """Bulk synthetic dataset: users, power-law follows, posts and nested comments.
+
+    Everything is derived from one random.Random(seed) and written with Core executemany
+    inserts in chunks, so the same arguments always produce the same rows (timestamps are
+    relative to the time of the run). Mapper events are bypassed; counters, timelines and the
+    search index are rebuilt at the end.
+    """
+
+    def __init__(self, users=10000, follows=20, posts=100000, comments=200000, seed=42,
+                 chunk_size=5000, days=365):
+        self.users = users
+        self.follows = follows
+        self.posts = posts
+        self.comments = comments
+        self.chunk_size = chunk_size
+        self.days = days
+        self.rng = random.Random(seed)
+        self.now = datetime.utcnow().replace(microsecond=0)
+        self.started = time.time()
+
+    def run(self, index=True):
+        from . import db
+        from .models import User, Post, Timeline
+        from .search import rebuild_index
+        self.seed_users()
+        self.seed_follows()
+        self.seed_posts()
+        self.seed_comments()
+        self.log('recounting')
+        User.recount()
+        Post.recount()
+        self.log('rebuilding timelines')
+        Timeline.rebuild()
+        if index:
+            rebuild_index(chunk_size=self.chunk_size)
+        db.session.remove()
+        self.log('done')
+
+    def log(self, message):
+        print('seed: %s (%.1fs)' % (message, time.time() - self.started))
+
+    def insert(self, table, rows):
+        from . import db
+        with db.engine.begin() as connection:
+            connection.execute(table.insert(), rows)
+
+    def chunks(self, rows):
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def next_id(self, column):
+        from . import db
+        return (db.session.query(db.func.max(column)).scalar() or 0) + 1
+
+    def power_law(self, ids):
+        """cum_weights for picking ids with a Zipf-like skew, ranks shuffled so hubs aren't the lowest ids"""
+        ranks = list(range(1, len(ids) + 1))
+        self.rng.shuffle(ranks)
+        return list(accumulate(1.0 / rank ** SKEW for rank in ranks))
+
+    def pick(self, ids, cum_weights):
+        return ids[bisect(cum_weights, self.rng.random() * cum_weights[-1])]
+
+    def sentence(self, low=3, high=30):
+        return ' '.join(self.rng.choice(WORDS) for _ in range(self.rng.randint(low, high)))
+
+    def moment(self, after=None):
+        start = after or self.now - timedelta(days=self.days)
+        span = max((self.now - start).total_seconds(), 1)
+        return start + timedelta(seconds=self.rng.random() * span)
+
+    def seed_users(self):
+        from . import db
+        from .models import User, Role, Follow
+        from .passwords import hash_password
+        self.first_user = self.next_id(User.id)
+        self.user_ids = list(range(self.first_user, self.first_user + self.users))
+        role_id = Role.query.filter_by(default=True).first().id
+        password_hash = hash_password(SEED_PASSWORD)
+        db.session.remove()
+
+        def rows():
+            for id in self.user_ids:
+                email = 'seed%d@example.com' % id
+                member_since = self.moment()
+                yield {'id': id, 'email': email, 'username': 'seed%d' % id, 'password_hash': password_hash,
+                       'confirmed': True, 'role_id': role_id, 'location': self.rng.choice(WORDS),
+                       'about_me': self.sentence(2, 10), 'member_since': member_since,
+                       'last_seen': self.moment(member_since), 'fanout_on_read': False,
+                       'avatar': hashlib.md5(email.encode('utf-8')).hexdigest()}
+
+        for chunk in self.chunks(rows()):
+            self.insert(User.__table__, chunk)
+            # 和 User.__init__ 一样，每个人都关注自己
+            self.insert(Follow.__table__, [{'follower_id': row['id'], 'followed_id': row['id'],
+                                            'timestamp': row['member_since']} for row in chunk])
+            self.log('users %d/%d' % (chunk[-1]['id'] - self.first_user + 1, self.users))
+
+    def seed_follows(self):
+        from .models import Follow
+        if self.users < 2 or not self.follows:
+            return
+        popularity = self.power_law(self.user_ids)
+        total = 0
+
+        def rows():
+            nonlocal total
+            for follower in self.user_ids:
+                count = min(int(self.rng.expovariate(1.0 / self.follows)), self.users - 1)
+                followed = set()
+                # 冷门用户很难被抽中，抽不满就算了
+                for _ in range(count * 10):
+                    if len(followed) >= count:
+                        break
+                    user = self.pick(self.user_ids, popularity)
+                    if user != follower:
+                        followed.add(user)
+                total += len(followed)
+                for user in sorted(followed):
+                    yield {'follower_id': follower, 'followed_id': user, 'timestamp': self.moment()}
+
+        for chunk in self.chunks(rows()):
+            self.insert(Follow.__table__, chunk)
+            self.log('follows %d' % total)
+
+    def seed_posts(self):
+        from .models import Post, PostType
+        self.first_post = self.next_id(Post.id)
+        # 帖子和评论的时间戳，评论总是晚于它回复的内容
+        self.timestamps = array('d')
+        activity = self.power_law(self.user_ids)
+
+        def rows():
+            for id in range(self.first_post, self.first_post + self.posts):
+                timestamp = self.moment()
+                self.timestamps.append(timestamp.timestamp())
+                yield self.post_row(id, self.pick(self.user_ids, activity), timestamp, PostType.POST, None)
+
+        for chunk in self.chunks(rows()):
+            self.insert(Post.__table__, chunk)
+            self.log('posts %d/%d' % (chunk[-1]['id'] - self.first_post + 1, self.posts))
+
+    def seed_comments(self):
+        from .models import Post, PostType
+        if not self.posts:
+            return
+        first_comment = self.first_post + self.posts
+        activity = self.power_law(self.user_ids)
+
+        def rows():
+            for id in range(first_comment, first_comment + self.comments):
+                # 七成回复帖子，其余回复之前的评论，形成多层的评论树
+                if id == first_comment or self.rng.random() < 0.7:
+                    parent = self.first_post + self.rng.randrange(self.posts)
+                else:
+                    parent = self.rng.randrange(first_comment, id)
+                timestamp = self.moment(datetime.fromtimestamp(self.timestamps[parent - self.first_post]))
+                self.timestamps.append(timestamp.timestamp())
+                yield self.post_row(id, self.pick(self.user_ids, activity), timestamp, PostType.COMMENT, parent)
+
+        for chunk in self.chunks(rows()):
+            self.insert(Post.__table__, chunk)
+            self.log('comments %d/%d' % (chunk[-1]['id'] - first_comment + 1, self.comments))
+
+    def post_row(self, id, author_id, timestamp, post_type, parent_post_id):
+        body = self.sentence()
+        # 纯文本单段落，markdown 渲染结果就是 <p>body</p>，省去逐条渲染
+        return {'id': id, 'body': body, 'body_html': '<p>%s</p>' % body, 'render_version': SANITIZER_VERSION,
+                'timestamp': timestamp, 'last_modified': timestamp, 'author_id': author_id,
+                'post_type': post_type, 'parent_post_id': parent_post_id, 'disabled': False}
@@ -0,0 +1,155 @@
+import gzip
+import json
+import os
+import time
+from datetime import datetime
+
+from sqlalchemy import DateTime
+
+from . import db
+
+# 按外键依赖排列，导入时依次写入
+SNAPSHOT_TABLES = ('users', 'follow', 'posts')
+MANIFEST = 'manifest.json'
+
+
+def encode(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError('%r is not JSON serializable' % value)
+
+
+def parse_datetime(value):
+    return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%f' if '.' in value else '%Y-%m-%dT%H:%M:%S')
+
+
+class Snapshot:
+    """Users, follows, posts and comments as gzip compressed NDJSON, one row per line.
+
+    Each table is written to numbered chunk files of at most `chunk_rows` rows, listed with
+    their row counts in manifest.json. Rows are streamed in both directions, so memory use
+    does not grow with the dataset. Ids are kept. Users carry the name of their role instead
+    of role_id, because role ids differ between databases.
+    """
+
+    def __init__(self, directory, chunk_rows=100000, batch_size=1000):
+        self.directory = directory
+        self.chunk_rows = chunk_rows
+        self.batch_size = batch_size
+        self.started = time.time()
+
+    def log(self, message):
+        print('snapshot: %s (%.1fs)' % (message, time.time() - self.started))
+
+    @staticmethod
+    def table(name):
+        return db.metadata.tables[name]
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def rows(self, table):
+        """Every row of table in primary key order, fetched batch_size at a time"""
+        query = table.select().order_by(*table.primary_key.columns)
+        with db.engine.connect() as conn:
+            result = conn.execution_options(stream_results=True).execute(query)
+            while True:
+                batch = result.fetchmany(self.batch_size)
+                if not batch:
+                    break
+                for row in batch:
+                    yield dict(row)
+
+    def export(self):
+        from .models import Role
+        os.makedirs(self.directory, exist_ok=True)
+        roles = {role.id: role.name for role in Role.query}
+        manifest = {'created_at': datetime.utcnow().isoformat(), 'tables': {}}
+        for name in SNAPSHOT_TABLES:
+            files = manifest['tables'][name] = []
+            out = None
+            for row in self.rows(self.table(name)):
+                if out is None or files[-1]['rows'] >= self.chunk_rows:
+                    if out is not None:
+                        out.close()
+                    files.append({'file': '%s-%05d.ndjson.gz' % (name, len(files)), 'rows': 0})
+                    out = gzip.open(self.path(files[-1]['file']), 'wt', encoding='utf-8', compresslevel=6)
+                if name == 'users':
+                    row['role'] = roles.get(row.pop('role_id'))
+                out.write(json.dumps(row, ensure_ascii=False, separators=(',', ':'), default=encode))
+                out.write('\n')
+                files[-1]['rows'] += 1
+            if out is not None:
+                out.close()
+            self.log('%s: %d rows in %d files' % (name, sum(f['rows'] for f in files), len(files)))
+        with open(self.path(MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=2)
+        return manifest
+
+    def read(self, files, convert):
+        for entry in files:
+            with gzip.open(self.path(entry['file']), 'rt', encoding='utf-8') as f:
+                for line in f:
+                    yield convert(json.loads(line))
+
+    def load(self, index=True):
+        """Bulk insert a snapshot into empty tables with Core executemany.
+
+        User.__init__ is bypassed, so there is no role lookup or self-follow commit per user:
+        roles are mapped by name once, self follows come with the follow rows, counters with
+        the user and post rows. Timelines and the search index are rebuilt at the end.
+        """
+        from .models import Role, Timeline
+        from .search import rebuild_index
+        with open(self.path(MANIFEST)) as f:
+            manifest = json.load(f)
+        for name in SNAPSHOT_TABLES:
+            if db.session.query(self.table(name)).first() is not None:
+                raise RuntimeError('%s is not empty, import a snapshot into an empty database' % name)
+        Role.insert_roles()
+        roles = {role.name: role.id for role in Role.query}
+        default_role = Role.query.filter_by(default=True).first().id
+        db.session.remove()
+        for name in SNAPSHOT_TABLES:
+            table = self.table(name)
+            columns = set(table.columns.keys())
+            dates = [column.name for column in table.columns if isinstance(column.type, DateTime)]
+
+            def convert(row):
+                # 快照里有而本库没有的列直接丢掉
+                row = {key: value for key, value in row.items() if key in columns or key == 'role'}
+                for key in dates:
+                    if row.get(key) is not None:
+                        row[key] = parse_datetime(row[key])
+                if name == 'users':
+                    row['role_id'] = roles.get(row.pop('role', None), default_role)
+                return row
+
+            files = manifest['tables'].get(name, [])
+            total = sum(entry['rows'] for entry in files)
+            done = 0
+            batch = []
+            for row in self.read(files, convert):
+                batch.append(row)
+                if len(batch) >= self.batch_size:
+                    done += self.insert(table, batch)
+                    batch = []
+                    if done % (self.batch_size * 100) == 0:
+                        self.log('%s %d/%d' % (name, done, total))
+            if batch:
+                done += self.insert(table, batch)
+            self.log('%s: %d rows imported' % (name, done))
+            if done != total:
+                raise RuntimeError('%s: %d rows imported, the manifest lists %d' % (name, done, total))
+        self.log('rebuilding timelines')
+        Timeline.rebuild()
+        if index:
+            rebuild_index(chunk_size=self.batch_size)
+        db.session.remove()
+        self.log('done')
+
+    @staticmethod
+    def insert(table, rows):
+        with db.engine.begin() as conn:
+            conn.execute(table.insert(), rows)
+        return len(rows)
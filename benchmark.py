@@ -0,0 +1,73 @@
+#! /usr/bin/env python
+"""Load benchmark of the main web and API endpoints against a local SQLite dataset.
+
+    python benchmark.py --scale 2000 --requests 400 --concurrency 8 --compare tmp/benchmarks/<old>.json
+
+The dataset is seeded once per database file (BENCHMARK_DATABASE_URL, default tmp/benchmark.sqlite);
+delete the file to change the scale. Each run is saved as JSON under tmp/benchmarks.
+"""
+import argparse
+import json
+import os
+import subprocess
+from datetime import datetime
+
+os.environ['CURRENT_ENV'] = 'benchmark'
+
+from app import create_app
+from app.benchmark import Benchmark, prepare_dataset, save_report, compare_reports
+
+base_dir = os.path.abspath(os.path.dirname(__file__))
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=base_dir).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the web and API endpoints')
+    parser.add_argument('--scale', type=int, default=1000, help='number of users of a newly seeded dataset')
+    parser.add_argument('--requests', type=int, default=200, help='measured requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=20, help='unmeasured requests per scenario')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--scenario', action='append', help='only run these scenarios')
+    parser.add_argument('--output', help='report path, default tmp/benchmarks/<time>-<commit>.json')
+    parser.add_argument('--compare', help='a previous report to compare with')
+    args = parser.parse_args()
+
+    app = create_app()
+    prepare_dataset(app, args.scale, seed=args.seed)
+    benchmark = Benchmark(app, requests=args.requests, concurrency=args.concurrency, warmup=args.warmup,
+                          seed=args.seed)
+    commit = current_commit()
+    report = {'commit': commit,
+              'created': datetime.utcnow().isoformat(),
+              'database': app.config['SQLALCHEMY_DATABASE_URI'],
+              'scale': args.scale,
+              'requests': args.requests,
+              'concurrency': args.concurrency,
+              'results': benchmark.run(args.scenario)}
+
+    output = args.output
+    if output is None:
+        directory = os.path.join(base_dir, 'tmp', 'benchmarks')
+        os.makedirs(directory, exist_ok=True)
+        output = os.path.join(directory, '%s-%s.json' % (datetime.utcnow().strftime('%Y%m%d%H%M%S'),
+                                                         commit or 'unknown'))
+    save_report(output, report)
+    print('report saved to %s' % output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print('compared with %s (%s):' % (args.compare, baseline.get('commit')))
+        for line in compare_reports(baseline, report):
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -20,17 +20,77 @@ class Config:
         .format(app_name=APP_NAME,
                 mail_username=os.environ.get('MAIL_USERNAME'))
     ADMIN = os.environ.get('ADMIN')
-    # 启用缓慢查询的记录
+    # 超过该秒数的查询记录为慢查询，见 app/metrics.py
     QUERY_DB_TIME_OUT = 0.05
-    SQLALCHEMY_RECORD_QUERIES = True
+    SQLALCHEMY_RECORD_QUERIES = False
+    # 按语句计数检测 N+1 的请求比例，同一语句在一个请求里执行 THRESHOLD 次即报告
+    METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE') or 0.1)
+    METRICS_NPLUSONE_THRESHOLD = 5
+    # 采样分析器，也可以由管理员在 /profiler 开关，只影响当前进程
+    PROFILER_ENABLED = os.environ.get('PROFILER_ENABLED') == '1'
+    PROFILER_INTERVAL = 0.01
+    PROFILER_MAX_STACKS = 20000
+    # 抓取 /metrics 时带上 Authorization: Bearer <METRICS_TOKEN>，未设置时只有管理员能查看
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
 
     MAIL_SERVER = os.environ.get('MAIL_SERVER')
     MAIL_PORT = os.environ.get('MAIL_PORT') or 25
     MAIL_USE_TLS = False
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
+    # manage.py mailworker
+    MAIL_WORKERS = 2
+    MAIL_BATCH_SIZE = 20
+    MAIL_MAX_ATTEMPTS = 5
+    MAIL_RETRY_BACKOFF = 60
     POSTS_PER_PAGE = 10
+    # 评论页里每条评论下展开的回复层数和回复总数，更多的回复点进该评论查看
+    THREAD_MAX_DEPTH = 3
+    THREAD_MAX_REPLIES = 200
+    # 流式 API（?stream=ndjson|json）每次读取和写出的记录数
+    API_STREAM_CHUNK_SIZE = 500
+    # 批量获取（?ids=）和批量创建一次最多处理的条数
+    API_BATCH_LIMIT = 100
+    # 粉丝数超过该值的作者发帖不再写入粉丝的 timeline，改为读取时合并
+    TIMELINE_FANOUT_LIMIT = 1000
+    # 关注某人时回填到 timeline 的最近帖子数
+    TIMELINE_BACKFILL_SIZE = 200
+    # 进程内关注关系索引：缓存多少个用户的关注列表、多久后重新加载、超过多少关注不缓存
+    FOLLOW_GRAPH_USERS = 10000
+    FOLLOW_GRAPH_TTL = 60
+    FOLLOW_GRAPH_MAX_EDGES = 50000
+    MARKDOWN_CACHE_SIZE = 2048
+    # last_seen 写缓冲：同一用户每 RESOLUTION 秒最多写一次，攒够 SIZE 个用户或过了 INTERVAL 秒批量写入
+    LAST_SEEN_RESOLUTION = 60
+    LAST_SEEN_FLUSH_INTERVAL = 30
+    LAST_SEEN_FLUSH_SIZE = 200
+    # 已验证的 API token 在本进程内缓存的最长秒数
+    TOKEN_CACHE_TTL = 300
+    # 用户身份与权限位在本进程内缓存的秒数，其他进程修改角色后最多延迟这么久生效
+    IDENTITY_CACHE_TTL = 300
+    # 帖子/评论渲染片段缓存，BACKEND 为 memory 或 redis://host:port/db、memcached://host:port
+    FRAGMENT_CACHE_BACKEND = os.environ.get('FRAGMENT_CACHE_BACKEND') or 'memory'
+    FRAGMENT_CACHE_SIZE = 4096
+    FRAGMENT_CACHE_TIMEOUT = 3600
+    # 密码哈希在独立的进程池中计算，0 表示在请求线程中计算
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:150000'
+    PASSWORD_HASH_WORKERS = 2
+    PASSWORD_HASH_QUEUE = 8
+    PASSWORD_HASH_TIMEOUT = 5
+    # Basic 认证成功后缓存 (email, 密码摘要) 的秒数
+    PASSWORD_CACHE_TTL = 60
     SQLALCHEMY_TRACK_MODIFICATIONS = True
+    # 只读副本（逗号分隔的连接串），标记了 @read_only 的视图的 GET 请求从副本读取
+    SQLALCHEMY_REPLICA_URIS = [uri for uri in (os.environ.get('DB_REPLICA_URIS') or '').split(',') if uri]
+    # 写入后这么多秒内，同一浏览器会话或 API 用户的请求仍然读主库，避开复制延迟
+    DB_REPLICA_STICKY_SECONDS = 5
+    # 主库和副本的连接池，SQLite 不使用；RECYCLE 要小于 MySQL 的 wait_timeout
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE') or 10)
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW') or 20)
+    DB_POOL_RECYCLE = 3600
+    DB_POOL_TIMEOUT = 10
+    # 从连接池取出连接时先 SELECT 1，数据库重启后不会把断开的连接交给请求
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1') == '1'
 
     @staticmethod
     def init_app(app):
@@ -49,6 +109,13 @@ class TestingConfig(Config):
         'DB_PWD') + '@localhost/zheer_dev'
 
 
+class BenchmarkConfig(Config):
+    SECRET_KEY = os.environ.get('SECRET_KEY') or 'benchmark'
+    SQLALCHEMY_DATABASE_URI = os.environ.get('BENCHMARK_DATABASE_URL') or \
+        'sqlite:///' + os.path.join(base_dir, 'tmp', 'benchmark.sqlite')
+    WTF_CSRF_ENABLED = False
+
+
 class ProductionConfig(Config):
     TESTING = False
     SQLALCHEMY_DATABASE_URI = 'mysql+pymysql://' + os.environ.get('DB_USER') + ':' + os.environ.get(
@@ -89,6 +156,7 @@ class UnixConfig(ProductionConfig):
 config = {
     'development': DevelopmentConfig,
     'testing': TestingConfig,
+    'benchmark': BenchmarkConfig,
     'production': ProductionConfig,
     'unixconfig': UnixConfig,
     'default': UnixConfig
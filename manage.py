@@ -1,7 +1,7 @@
 import os
 
 from flask_migrate import Migrate, MigrateCommand
-from flask_script import Manager, Shell
+from flask_script import Command, Manager, Shell
 
 from app import create_app, db
 from app.models import User, Role, Post
@@ -62,14 +62,114 @@ def profile(length=25, profile_dir=None):
 
 
 @manager.command
-def deploy():
+def deploy(dry_run=False):
     """Run the deployment tasks"""
-    from  flask_migrate import upgrade
-    from app.models import Role, User
-    upgrade()
+    from flask_migrate import upgrade
+    from app.jobs import run_jobs, DEPLOY_JOBS
+    if not dry_run:
+        upgrade()
+    run_jobs(DEPLOY_JOBS, dry_run=dry_run)
 
-    Role.insert_roles()
-    User.follow_them_self()
+
+@manager.command
+def maintenance(name=None, chunk_size=1000, dry_run=False, restart=False):
+    """Run a maintenance job (comma separated names), or list the jobs and what they have pending"""
+    from app.jobs import jobs, run_jobs
+    if name is None:
+        for job_class in jobs.values():
+            print('%-14s %8d pending  %s' % (job_class.name, job_class(restart=restart).pending(), job_class.help))
+        return
+    run_jobs(name.split(','), chunk_size=int(chunk_size), dry_run=dry_run, restart=restart)
+
+
+# comments/chunk_size、seed/skip_index 首字母相同，显式声明选项
+@manager.option('-u', '--users', type=int, default=10000)
+@manager.option('-f', '--follows', type=int, default=20, help='average follows per user')
+@manager.option('-p', '--posts', type=int, default=100000)
+@manager.option('-c', '--comments', type=int, default=200000)
+@manager.option('-s', '--seed', type=int, default=42, help='random seed, the same seed gives the same rows')
+@manager.option('--chunk_size', type=int, default=5000)
+@manager.option('--skip_index', action='store_true', help='do not build the search index')
+def seed(users, follows, posts, comments, seed, chunk_size, skip_index):
+    """Bulk insert a reproducible synthetic dataset, e.g. for performance testing"""
+    from app.seed import Seeder
+    Seeder(users=users, follows=follows, posts=posts, comments=comments, seed=seed,
+           chunk_size=chunk_size).run(index=not skip_index)
+
+
+@manager.command
+def recount():
+    """Repair the denormalized post, comment and follow counters"""
+    from app.models import User, Post
+    User.recount()
+    Post.recount()
+
+
+@manager.command
+def mailworker(workers=None, batch_size=None, once=False):
+    """Deliver queued mails from the outbox with a pool of SMTP workers"""
+    from app.email import MailWorker
+    worker = MailWorker(app,
+                        workers=int(workers or app.config['MAIL_WORKERS']),
+                        batch_size=int(batch_size or app.config['MAIL_BATCH_SIZE']),
+                        max_attempts=app.config['MAIL_MAX_ATTEMPTS'],
+                        backoff=app.config['MAIL_RETRY_BACKOFF'])
+    worker.run(once=once)
+
+
+@manager.command
+def rerender(workers=4, chunk_size=500):
+    """Re-render body_html of posts rendered with an older sanitizer policy"""
+    from app.render import rerender_posts
+    rerender_posts(workers=int(workers), chunk_size=int(chunk_size))
+
+
+@manager.command
+def reindex(chunk_size=1000):
+    """Rebuild the full-text search index of posts and comments"""
+    from app.search import rebuild_index
+    rebuild_index(chunk_size=int(chunk_size))
+
+
+# 参数首字母重复（target/truncate），自动生成的短选项会冲突，显式声明
+@manager.option('-s', '--source', default='sqlite:///data.sqlite', help='database to copy from')
+@manager.option('-t', '--target', default=None, help="database to copy into, default this app's database")
+@manager.option('-b', '--batch_size', type=int, default=1000)
+@manager.option('-w', '--workers', type=int, default=4)
+@manager.option('--truncate', action='store_true', help='empty target tables that already hold rows')
+@manager.option('-v', '--verify_only', action='store_true', help='compare the databases without copying')
+def migrate_data(source, target, batch_size, workers, truncate, verify_only):
+    """Copy the data of another database (data.sqlite by default) into this app's database and verify it"""
+    from app.migrator import DataMigrator
+    migrator = DataMigrator(source, target or DATABASE_URI, db.metadata, batch_size=batch_size,
+                            workers=workers, truncate=truncate)
+    results = migrator.verify_all() if verify_only else migrator.run()
+    failed = sorted(name for name, result in results.items() if not result.ok)
+    if failed:
+        raise SystemExit('row count or checksum differs for %s' % ', '.join(failed))
+
+
+@manager.command
+def export(directory='tmp/snapshot', chunk_rows=100000, batch_size=1000):
+    """Write users, follows, posts and comments to compressed NDJSON files in directory"""
+    from app.snapshot import Snapshot
+    Snapshot(directory, chunk_rows=int(chunk_rows), batch_size=int(batch_size)).export()
+
+
+def import_snapshot(directory='tmp/snapshot', batch_size=1000, skip_index=False):
+    """Bulk load a snapshot written by export into an empty database, keeping the ids"""
+    from app.snapshot import Snapshot
+    Snapshot(directory, batch_size=int(batch_size)).load(index=not skip_index)
+
+
+manager.add_command('import', Command(import_snapshot))
+
+
+@manager.command
+def rebuild_timeline():
+    """Rebuild every user's materialized timeline from the follow table"""
+    from app.models import Timeline
+    Timeline.rebuild()
 
 
 if __name__ == '__main__':
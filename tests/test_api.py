@@ -0,0 +1,214 @@
+import os
+import shutil
+import tempfile
+import unittest
+from base64 import b64encode
+from datetime import datetime, timedelta
+
+from werkzeug.http import http_date
+
+from app import create_app, db
+from app.identity import clear_cache
+from app.models import Post, Role, User
+from app.presence import last_seen_buffer
+
+
+class APITestCase(unittest.TestCase):
+    """The JSON API on a SQLite database, with one confirmed user authenticated by token"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.app = create_app()
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(self.dir, 'data.sqlite')
+        self.app.config['SECRET_KEY'] = 'test'
+        self.app.config['PASSWORD_HASH_WORKERS'] = 0
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        Role.insert_roles()
+        clear_cache()
+        self.user = User(email='a@example.com', username='a', password='cat', confirmed=True)
+        db.session.add(self.user)
+        db.session.commit()
+        self.token = self.user.generate_auth_token()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        last_seen_buffer.flush()
+        db.session.remove()
+        self.context.pop()
+        shutil.rmtree(self.dir)
+
+    def headers(self, **headers):
+        headers['Authorization'] = 'Basic ' + b64encode((self.token + ':').encode('utf-8')).decode('ascii')
+        return headers
+
+    def get(self, url, **headers):
+        return self.client.get(url, headers=self.headers(**headers))
+
+    def post(self, url, json):
+        return self.client.post(url, json=json, headers=self.headers())
+
+    def new_post(self, body='hello'):
+        response = self.post('/api/1.0/posts/', {'body': body})
+        self.assertEqual(response.status_code, 201)
+        return int(response.get_json()['url'].rsplit('/', 1)[1])
+
+
+class ConditionalGetTestCase(APITestCase):
+    def setUp(self):
+        APITestCase.setUp(self)
+        self.id = self.new_post()
+
+    def test_if_none_match(self):
+        response = self.get('/api/1.0/posts/%d' % self.id)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        self.assertTrue(etag.startswith('W/'))
+        response = self.get('/api/1.0/posts/%d' % self.id, **{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertEqual(self.get('/api/1.0/posts/%d' % self.id, **{'If-None-Match': 'W/"other"'}).status_code, 200)
+
+    def test_if_modified_since(self):
+        response = self.get('/api/1.0/posts/%d' % self.id)
+        last_modified = response.headers['Last-Modified']
+        self.assertEqual(self.get('/api/1.0/posts/%d' % self.id, **{'If-Modified-Since': last_modified}).status_code,
+                         304)
+        earlier = http_date(datetime.utcnow() - timedelta(days=1))
+        self.assertEqual(self.get('/api/1.0/posts/%d' % self.id, **{'If-Modified-Since': earlier}).status_code, 200)
+
+    def test_missing_post_is_not_cached(self):
+        response = self.get('/api/1.0/posts/%d' % (self.id + 1))
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn('ETag', response.headers)
+
+    def etag(self, url):
+        return self.get(url).headers['ETag']
+
+    def test_edit_changes_validator(self):
+        url = '/api/1.0/posts/%d' % self.id
+        # 修改帖子的接口要求审核权限
+        self.user.role = Role.query.filter_by(name='Moderator').first()
+        db.session.commit()
+        before = self.etag(url), self.etag('/api/1.0/posts/')
+        response = self.client.put(url, json={'body': 'edited'}, headers=self.headers())
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual((self.etag(url), self.etag('/api/1.0/posts/')), before)
+        self.assertEqual(self.get(url, **{'If-None-Match': before[0]}).get_json()['body'], 'edited')
+
+    def test_comment_changes_validator(self):
+        urls = ['/api/1.0/posts/%d' % self.id, '/api/1.0/posts/%d/comments/' % self.id,
+                '/api/1.0/users/%d/posts/' % self.user.id]
+        before = [self.etag(url) for url in urls]
+        response = self.post('/api/1.0/posts/%d/comments/' % self.id, {'body': 'a comment'})
+        self.assertEqual(response.status_code, 201)
+        for url, etag in zip(urls, before):
+            self.assertNotEqual(self.etag(url), etag, url)
+        self.assertEqual(self.get(urls[0]).get_json()['comments_count'], 1)
+
+    def test_delete_changes_list_validator(self):
+        other = self.new_post('another')
+        before = self.etag('/api/1.0/posts/')
+        db.session.delete(Post.query.get(self.id))
+        db.session.commit()
+        self.assertNotEqual(self.etag('/api/1.0/posts/'), before)
+        self.assertIsNotNone(Post.query.get(other))
+
+    def test_cache_control_per_endpoint(self):
+        for url, max_age in (('/api/1.0/user/%d' % self.user.id, 60),
+                             ('/api/1.0/posts/%d' % self.id, 30),
+                             ('/api/1.0/posts/', 0),
+                             ('/api/1.0/users/%d/posts/' % self.user.id, 0),
+                             ('/api/1.0/posts/%d/comments/' % self.id, 0)):
+            response = self.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertEqual(response.headers['Cache-Control'], 'private, max-age=%d, must-revalidate' % max_age,
+                             url)
+
+
+class BatchTestCase(APITestCase):
+    def setUp(self):
+        APITestCase.setUp(self)
+        self.app.config['API_BATCH_LIMIT'] = 5
+
+    def test_multi_get_keeps_order_and_lists_missing(self):
+        ids = [self.new_post('p%d' % i) for i in range(3)]
+        response = self.get('/api/1.0/posts/?ids=%d,999,%d,%d' % (ids[2], ids[0], ids[1]))
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual([post['body'] for post in data['posts']], ['p2', 'p0', 'p1'])
+        self.assertEqual(data['missing'], [999])
+        users = self.get('/api/1.0/users/?ids=%d,42' % self.user.id).get_json()
+        self.assertEqual([user['username'] for user in users['users']], ['a'])
+        self.assertEqual(users['missing'], [42])
+
+    def test_multi_get_rejects_bad_ids(self):
+        for url in ('/api/1.0/posts/?ids=1,x', '/api/1.0/posts/?ids=1,2,3,4,5,6', '/api/1.0/users/?ids=a'):
+            response = self.get(url)
+            self.assertEqual(response.status_code, 400, url)
+            self.assertEqual(response.get_json()['status'], 400)
+        self.assertEqual(self.get('/api/1.0/posts/?ids=').get_json(), {'posts': [], 'missing': []})
+
+    def test_bulk_create_all_valid(self):
+        response = self.post('/api/1.0/posts/batch', {'items': [{'body': 'a'}, {'body': '**b**'}]})
+        self.assertEqual(response.status_code, 201)
+        data = response.get_json()
+        self.assertEqual(data['created'], 2)
+        self.assertEqual([result['status'] for result in data['results']], [201, 201])
+        self.assertIn('<strong>b</strong>', data['results'][1]['post']['body_html'])
+        self.assertEqual(Post.query.filter_by(author_id=self.user.id).count(), 2)
+
+    def test_bulk_create_partial(self):
+        response = self.post('/api/1.0/posts/batch', [{'body': 'a'}, {'body': ''}, 'not an object'])
+        self.assertEqual(response.status_code, 207)
+        data = response.get_json()
+        self.assertEqual(data['created'], 1)
+        self.assertEqual([result['status'] for result in data['results']], [201, 412, 412])
+        self.assertEqual(Post.query.count(), 1)
+
+    def test_bulk_create_none_valid(self):
+        response = self.post('/api/1.0/posts/batch', [{'body': ''}, {}])
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(response.get_json()['created'], 0)
+        self.assertEqual(Post.query.count(), 0)
+
+    def test_bulk_create_rejects_bad_batches(self):
+        for items in ([], {'items': []}, {'body': 'not a list'}, [{'body': str(i)} for i in range(6)]):
+            self.assertEqual(self.post('/api/1.0/posts/batch', items).status_code, 412)
+        self.assertEqual(Post.query.count(), 0)
+
+    def test_bulk_comments(self):
+        id = self.new_post()
+        response = self.post('/api/1.0/posts/%d/comments/batch' % id, [{'body': 'c1'}, {'body': 'c2'}])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Post.query.get(id).comments_count, 2)
+        self.assertEqual(self.post('/api/1.0/posts/999/comments/batch', [{'body': 'c'}]).status_code, 404)
+
+
+class ThreadTestCase(APITestCase):
+    def comment(self, id, body):
+        response = self.post('/api/1.0/posts/%d/comments/' % id, {'body': body})
+        self.assertEqual(response.status_code, 201)
+        return int(response.get_json()['url'].rsplit('/', 1)[1])
+
+    def test_thread_nests_replies(self):
+        id = self.new_post()
+        a = self.comment(id, 'a')
+        self.comment(id, 'b')
+        a1 = self.comment(a, 'a1')
+        self.comment(a1, 'a2')
+        data = self.get('/api/1.0/posts/%d/thread' % id).get_json()
+        self.assertEqual([comment['body'] for comment in data['comments']], ['a', 'b'])
+        a_json = data['comments'][0]
+        self.assertEqual(a_json['replies'][0]['body'], 'a1')
+        self.assertEqual(a_json['replies'][0]['replies'][0]['body'], 'a2')
+        self.assertIsNone(a_json['more_replies'])
+        self.assertIsNone(data['next'])
+
+        data = self.get('/api/1.0/posts/%d/thread?depth=1&size=1' % id).get_json()
+        a_json, = data['comments']
+        self.assertEqual(a_json['replies'][0]['replies'], [])
+        self.assertTrue(a_json['replies'][0]['more_replies'].endswith('/api/1.0/posts/%d/thread' % a1))
+        self.assertEqual([comment['body'] for comment in self.get(data['next']).get_json()['comments']], ['b'])
@@ -0,0 +1,21 @@
+import unittest
+from array import array
+
+from app.follows import FollowGraph
+
+
+class FollowGraphTestCase(unittest.TestCase):
+    def setUp(self):
+        self.graph = FollowGraph()
+        self.graph.lists.set(1, array('l', [1, 3, 7]))
+
+    def test_lookups(self):
+        self.assertTrue(self.graph.is_following(1, 3))
+        self.assertFalse(self.graph.is_following(1, 4))
+        self.assertEqual(self.graph.following_among(1, [2, 3, 7, 9]), {3, 7})
+
+    def test_add_and_remove_keep_order(self):
+        self.graph.add(1, 5)
+        self.graph.add(1, 5)
+        self.graph.remove(1, 3)
+        self.assertEqual(list(self.graph.followed_ids(1)), [1, 5, 7])
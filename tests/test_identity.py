@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+import unittest
+from base64 import b64encode
+
+from app import create_app, db
+from app.identity import Identity, clear_cache, get_serializer, verify_auth_token
+from app.models import Permission, Post, Role, User
+from app.presence import last_seen_buffer
+
+
+class IdentityTestCase(unittest.TestCase):
+    """Token verification against a SQLite database; Core updates change rows without invalidating"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.app = create_app()
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(self.dir, 'data.sqlite')
+        self.app.config['SECRET_KEY'] = 'test'
+        self.app.config['PASSWORD_HASH_WORKERS'] = 0
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        Role.insert_roles()
+        # 各个测试的库里 id 相同，进程内的缓存要清掉
+        clear_cache()
+        self.user = User(email='a@example.com', username='a', password='cat', confirmed=True)
+        db.session.add(self.user)
+        db.session.commit()
+        self.token = self.user.generate_auth_token()
+
+    def tearDown(self):
+        last_seen_buffer.flush()
+        db.session.remove()
+        self.context.pop()
+        shutil.rmtree(self.dir)
+
+    def update_behind_cache(self, **values):
+        """Change the user row without the mapper events, as another process would"""
+        db.engine.execute(User.__table__.update().where(User.__table__.c.id == self.user.id).values(**values))
+
+    def verify(self, token=None, uuid=None):
+        return verify_auth_token(token or self.token, uuid)
+
+    def test_valid_token(self):
+        identity = self.verify()
+        self.assertIsInstance(identity, Identity)
+        self.assertEqual((identity.id, identity.username, identity.confirmed), (self.user.id, 'a', True))
+        self.assertTrue(identity.can(Permission.POST_ARTICLES))
+        self.assertFalse(identity.is_administrator())
+
+    def test_identity_is_cached(self):
+        self.verify()
+        self.update_behind_cache(username='renamed')
+        self.assertEqual(self.verify().username, 'a')
+
+    def test_role_change_evicts(self):
+        self.verify()
+        self.user.role = Role.query.filter_by(name='Administrator').first()
+        db.session.commit()
+        self.assertTrue(self.verify().is_administrator())
+
+    def test_confirmed_change_evicts(self):
+        self.verify()
+        self.user.confirmed = False
+        db.session.commit()
+        self.assertFalse(self.verify().confirmed)
+
+    def test_password_reset_evicts(self):
+        self.verify()
+        self.update_behind_cache(username='renamed')
+        self.user.password = 'dog'
+        db.session.commit()
+        self.assertEqual(self.verify().username, 'renamed')
+
+    def test_permission_change_evicts(self):
+        self.verify()
+        role = Role.query.filter_by(default=True).first()
+        role.permissions = Permission.FOLLOW
+        db.session.commit()
+        self.assertFalse(self.verify().can(Permission.POST_ARTICLES))
+
+    def test_invalid_tokens(self):
+        expired = get_serializer('test', -10).dumps({'id': self.user.id, 'uuid': None})
+        other_key = get_serializer('other').dumps({'id': self.user.id, 'uuid': None})
+        for token in (expired, other_key, 'garbage', self.token[:-2]):
+            self.assertIsNone(self.verify(token))
+        self.assertIsNone(self.verify(uuid='device'))
+        self.assertIsNotNone(self.verify(self.user.generate_auth_token(uuid='device'), 'device'))
+
+    def test_deleted_user(self):
+        db.engine.execute(User.__table__.delete())
+        self.assertIsNone(self.verify())
+
+    def test_token_auth_api(self):
+        def headers(token):
+            return {'Authorization': 'Basic ' + b64encode((token + ':').encode('utf-8')).decode('ascii')}
+
+        client = self.app.test_client()
+        response = client.post('/api/1.0/posts/', json={'body': 'hello'}, headers=headers(self.token))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Post.query.filter_by(author_id=self.user.id).count(), 1)
+        self.assertEqual(client.get('/api/1.0/posts/', headers=headers(self.token)).status_code, 200)
+        self.assertEqual(client.get('/api/1.0/posts/', headers=headers('garbage')).status_code, 401)
+        self.user.confirmed = False
+        db.session.commit()
+        response = client.get('/api/1.0/posts/', headers=headers(self.token))
+        self.assertEqual(response.get_json()['error'], 'un confirmed account')
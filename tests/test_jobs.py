@@ -0,0 +1,53 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+from app import create_app, db
+from app.jobs import DEPLOY_JOBS, jobs
+from app.models import Follow, Post, Role, User
+from app.seed import Seeder
+
+
+class RecountJobTestCase(unittest.TestCase):
+    """Counters left at their server default, as after adding the columns to an existing database"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.app = create_app()
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(self.dir, 'data.sqlite')
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        Role.insert_roles()
+        with redirect_stdout(io.StringIO()):
+            Seeder(users=20, follows=3, posts=30, comments=30, chunk_size=10).run(index=False)
+        db.engine.execute(User.__table__.update().values(posts_count=0, followers_count=0, followed_count=0))
+        db.engine.execute(Post.__table__.update().values(comments_count=0))
+
+    def tearDown(self):
+        db.session.remove()
+        self.context.pop()
+        shutil.rmtree(self.dir)
+
+    def run_job(self, **kwargs):
+        with redirect_stdout(io.StringIO()):
+            return jobs['recount'](**kwargs).run()
+
+    def test_deploy_recounts_before_timeline(self):
+        self.assertLess(DEPLOY_JOBS.index('recount'), DEPLOY_JOBS.index('timeline'))
+
+    def test_recount_repairs_counters(self):
+        self.assertGreater(jobs['recount']().pending(), 0)
+        self.assertEqual(self.run_job(dry_run=True), 0)
+        self.assertGreater(self.run_job(), 0)
+        self.assertEqual(jobs['recount']().pending(), 0)
+        for user in User.query:
+            self.assertEqual(user.followers_count, Follow.query.filter_by(followed_id=user.id).count())
+            self.assertEqual(user.followed_count, Follow.query.filter_by(follower_id=user.id).count())
+            self.assertEqual(user.posts_count, Post.query.filter_by(author_id=user.id).count())
+        for post in Post.query:
+            self.assertEqual(post.comments_count, Post.query.filter_by(parent_post_id=post.id).count())
+        self.assertEqual(self.run_job(), 0)
@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from app import create_app, db
+from app.loaders import load_replies, supports_recursive_cte
+from app.models import Post, PostType
+
+
+def engine(name, version, **dialect):
+    return SimpleNamespace(dialect=SimpleNamespace(name=name, server_version_info=version, **dialect))
+
+
+class RecursiveCTESupportTestCase(unittest.TestCase):
+    def test_versions(self):
+        self.assertTrue(supports_recursive_cte(engine('mysql', (8, 0, 21))))
+        self.assertFalse(supports_recursive_cte(engine('mysql', (5, 7, 30))))
+        self.assertTrue(supports_recursive_cte(engine('mysql', (10, 3, 7, 'MariaDB'))))
+        self.assertFalse(supports_recursive_cte(engine('mysql', (10, 1, 48, 'MariaDB'))))
+        self.assertFalse(supports_recursive_cte(engine('mysql', (10, 1, 48), _is_mariadb=True)))
+        self.assertTrue(supports_recursive_cte(engine('sqlite', (3, 31, 1))))
+        self.assertFalse(supports_recursive_cte(engine('sqlite', (3, 7, 17))))
+        self.assertFalse(supports_recursive_cte(engine('mysql', None)))
+
+
+class LoadRepliesTestCase(unittest.TestCase):
+    """A post with comments a, b, c; a has the chain a1 > a2 > a3 > a4, b has b1 and b2"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.app = create_app()
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(self.dir, 'data.sqlite')
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        self.started = datetime(2020, 1, 1)
+        post = self.add('post', None)
+        a, b = self.add('a', post), self.add('b', post)
+        self.add('c', post)
+        parent = a
+        for body in ('a1', 'a2', 'a3', 'a4'):
+            parent = self.add(body, parent)
+        self.add('b1', b)
+        self.add('b2', b)
+        self.post_id = post.id
+        db.session.expunge_all()
+
+    def tearDown(self):
+        db.session.remove()
+        self.context.pop()
+        shutil.rmtree(self.dir)
+
+    def add(self, body, parent):
+        self.started += timedelta(minutes=1)
+        post = Post(body=body, timestamp=self.started, parent_post=parent,
+                    post_type=PostType.POST if parent is None else PostType.COMMENT)
+        db.session.add(post)
+        db.session.commit()
+        return post
+
+    def comments(self):
+        return Post.query.filter(Post.parent_post_id == self.post_id).order_by(Post.timestamp).all()
+
+    def tree(self, recursive, **kwargs):
+        comments = self.comments()
+        load_replies(comments, recursive=recursive, **kwargs)
+
+        def node(post):
+            return post.body, post.more_replies, [node(reply) for reply in post.replies]
+        return [node(comment) for comment in comments]
+
+    def test_both_loaders_agree(self):
+        for kwargs in ({}, {'max_depth': 2}, {'limit': 3}, {'limit': 1}, {'max_depth': 5, 'limit': 100}):
+            self.assertEqual(self.tree(True, **kwargs), self.tree(False, **kwargs), kwargs)
+
+    def test_depth_cut(self):
+        a, b, c = self.tree(False, max_depth=3)
+        self.assertEqual(a, ('a', False, [('a1', False, [('a2', False, [('a3', True, [])])])]))
+        self.assertEqual(b, ('b', False, [('b1', False, []), ('b2', False, [])]))
+        self.assertEqual(c, ('c', False, []))
+
+    def test_limit_is_breadth_first(self):
+        a, b, c = self.tree(False, limit=3)
+        # 第一层 a1、b1、b2 先占满名额
+        self.assertEqual(a, ('a', False, [('a1', True, [])]))
+        self.assertEqual(b, ('b', False, [('b1', False, []), ('b2', False, [])]))
+
+    def test_one_query_per_level(self):
+        comments = self.comments()
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        db.event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            load_replies(comments, max_depth=3, recursive=False)
+        finally:
+            db.event.remove(db.engine, 'before_cursor_execute', record)
+        self.assertEqual(len(statements), 3)
+        self.assertFalse(any('RECURSIVE' in statement for statement in statements))
@@ -0,0 +1,12 @@
+import unittest
+
+from manage import manager
+
+
+class ManageCommandsTestCase(unittest.TestCase):
+    def test_every_command_builds_its_parser(self):
+        # 选项冲突时 argparse 在这里抛出 ArgumentError，整个 manage.py 都会无法运行
+        manager.create_parser('manage.py')
+        for name, command in manager._commands.items():
+            with self.subTest(command=name):
+                command.create_parser('manage.py %s' % name)
@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from app import create_app, db
+from app.metrics import Histogram, Counter
+from app.models import Role, User
+from app.presence import last_seen_buffer
+
+
+class MetricsExportTestCase(unittest.TestCase):
+    def test_histogram_is_cumulative(self):
+        histogram = Histogram('queries', 'help', ('endpoint',), (1, 5, 10))
+        for value in (1, 3, 7, 20):
+            histogram.observe(('main.home',), value)
+        lines = histogram.export()
+        self.assertIn('queries_bucket{endpoint="main.home",le="1"} 1', lines)
+        self.assertIn('queries_bucket{endpoint="main.home",le="5"} 2', lines)
+        self.assertIn('queries_bucket{endpoint="main.home",le="10"} 3', lines)
+        self.assertIn('queries_bucket{endpoint="main.home",le="+Inf"} 4', lines)
+        self.assertIn('queries_count{endpoint="main.home"} 4', lines)
+
+    def test_counter_escapes_labels(self):
+        counter = Counter('nplusone', 'help', ('location',))
+        counter.inc(('a "b"',), 2)
+        self.assertIn('nplusone{location="a \\"b\\""} 2', counter.export())
+
+
+class MetricsEndpointTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.app = create_app()
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(self.dir, 'data.sqlite')
+        self.app.config['SECRET_KEY'] = 'test'
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.app.config['PASSWORD_HASH_WORKERS'] = 0
+        self.app.config['METRICS_TOKEN'] = 'secret'
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        last_seen_buffer.flush()
+        db.session.remove()
+        self.context.pop()
+        shutil.rmtree(self.dir)
+
+    def get(self, **headers):
+        return self.client.get('/metrics', headers=headers).status_code
+
+    def test_local_address_is_not_enough(self):
+        # 反向代理转发的请求都来自 127.0.0.1
+        self.assertEqual(self.client.get('/metrics', environ_base={'REMOTE_ADDR': '127.0.0.1'}).status_code, 403)
+
+    def test_bearer_token(self):
+        self.assertEqual(self.get(Authorization='Bearer secret'), 200)
+        self.assertEqual(self.get(Authorization='Bearer wrong'), 403)
+        self.assertEqual(self.get(Authorization='secret'), 403)
+        self.app.config['METRICS_TOKEN'] = None
+        self.assertEqual(self.get(Authorization='Bearer '), 403)
+
+    def login(self, role):
+        user = User(email='%s@example.com' % role.lower(), username=role, password='cat', confirmed=True,
+                    role=Role.query.filter_by(name=role).first())
+        db.session.add(user)
+        db.session.commit()
+        self.client.post('/auth/login', data={'email': user.email, 'password': 'cat'})
+
+    def test_administrator(self):
+        self.login('Administrator')
+        self.assertEqual(self.get(), 200)
+
+    def test_other_users(self):
+        self.login('Moderator')
+        self.assertEqual(self.get(), 403)
@@ -0,0 +1,61 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Float, ForeignKey, Integer, MetaData, String, Table, create_engine
+
+from app.migrator import DataMigrator, normalize, table_levels
+
+metadata = MetaData()
+users = Table('users', metadata, Column('id', Integer, primary_key=True), Column('name', String(64)),
+              Column('since', DateTime))
+posts = Table('posts', metadata, Column('id', Integer, primary_key=True),
+              Column('author_id', Integer, ForeignKey('users.id')),
+              Column('parent_id', Integer, ForeignKey('posts.id')), Column('score', Float))
+follows = Table('follows', metadata, Column('follower_id', Integer, ForeignKey('users.id'), primary_key=True),
+                Column('followed_id', Integer, ForeignKey('users.id'), primary_key=True))
+
+
+class DataMigratorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.source = 'sqlite:///' + os.path.join(self.dir, 'source.sqlite')
+        self.target = 'sqlite:///' + os.path.join(self.dir, 'target.sqlite')
+        engine = create_engine(self.source)
+        metadata.create_all(engine)
+        engine.execute(users.insert(), [{'id': i, 'name': 'user%d' % i, 'since': datetime(2020, 1, 1, 0, 0, i)}
+                                        for i in range(1, 51)])
+        engine.execute(posts.insert(), [{'id': i, 'author_id': i % 50 + 1, 'parent_id': i - 1 if i % 3 else None,
+                                         'score': i / 7.0} for i in range(1, 251)])
+        engine.execute(follows.insert(), [{'follower_id': i, 'followed_id': i % 50 + 1} for i in range(1, 51)])
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_levels_respect_foreign_keys(self):
+        levels = [[table.name for table in level] for level in table_levels(metadata.sorted_tables)]
+        self.assertEqual(levels, [['users'], ['follows', 'posts']])
+
+    def test_normalize(self):
+        self.assertEqual(normalize(datetime(2020, 1, 1, 0, 0, 1, 5000)), datetime(2020, 1, 1, 0, 0, 1))
+        self.assertEqual(normalize(1 / 3.0), normalize(0.33333334))
+
+    def test_copy_and_verify(self):
+        results = DataMigrator(self.source, self.target, metadata, batch_size=16, workers=2).run()
+        self.assertEqual({name: result.target_rows for name, result in results.items()},
+                         {'users': 50, 'posts': 250, 'follows': 50})
+        self.assertTrue(all(result.ok for result in results.values()))
+
+        create_engine(self.target).execute(posts.update().where(posts.c.id == 7).values(score=0))
+        results = DataMigrator(self.source, self.target, metadata).verify_all()
+        self.assertFalse(results['posts'].ok)
+        self.assertTrue(results['users'].ok)
+
+    def test_refuses_filled_target(self):
+        DataMigrator(self.source, self.target, metadata).run(verify=False)
+        with self.assertRaises(RuntimeError):
+            DataMigrator(self.source, self.target, metadata).run()
+        results = DataMigrator(self.source, self.target, metadata, truncate=True).run()
+        self.assertEqual(results['posts'].target_rows, 250)
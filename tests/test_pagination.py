@@ -0,0 +1,112 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from app import create_app, db
+from app.models import Post
+from app.pagination import KeysetPagination, encode_cursor, decode_cursor
+
+
+class CursorTestCase(unittest.TestCase):
+    def test_round_trip(self):
+        ts = datetime(2018, 1, 2, 3, 4, 5, 678)
+        cursor = encode_cursor([ts, 42])
+        self.assertEqual(decode_cursor(cursor), ([ts, 42], False))
+
+    def test_backwards_flag(self):
+        cursor = encode_cursor([datetime(2018, 1, 1), 1], backwards=True)
+        values, backwards = decode_cursor(cursor)
+        self.assertTrue(backwards)
+        self.assertEqual(values[1], 1)
+
+    def test_cursor_is_url_safe(self):
+        cursor = encode_cursor([datetime.utcnow(), 10 ** 12])
+        self.assertNotIn('=', cursor)
+        self.assertNotIn('/', cursor)
+        self.assertNotIn('+', cursor)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(decode_cursor(None), (None, False))
+        self.assertEqual(decode_cursor('not a cursor'), (None, False))
+        self.assertEqual(decode_cursor(encode_cursor([1])[:-3]), (None, False))
+
+
+class KeysetPaginationTestCase(unittest.TestCase):
+    """12 posts, three per timestamp, paged 5 at a time newest first"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.app = create_app()
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(self.dir, 'data.sqlite')
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        start = datetime(2020, 1, 1)
+        # 直接插入，绕开 Post 的事件
+        db.engine.execute(Post.__table__.insert(), [{'id': i, 'body': 'p%d' % i, 'timestamp': start + timedelta(
+            minutes=(i - 1) // 3)} for i in range(1, 13)])
+        self.ids = list(range(12, 0, -1))
+
+    def tearDown(self):
+        db.session.remove()
+        self.context.pop()
+        shutil.rmtree(self.dir)
+
+    def page(self, cursor=None, **kwargs):
+        return KeysetPagination(Post.query, [Post.timestamp, Post.id], cursor=cursor, per_page=5, **kwargs)
+
+    def ids_of(self, pagination):
+        return [post.id for post in pagination.items]
+
+    def test_first_page(self):
+        pagination = self.page()
+        self.assertEqual(self.ids_of(pagination), self.ids[:5])
+        self.assertTrue(pagination.has_next)
+        self.assertFalse(pagination.has_prev)
+        self.assertIsNone(pagination.prev_cursor)
+        self.assertIsNone(pagination.total)
+
+    def test_next_pages_break_timestamp_ties_by_id(self):
+        second = self.page(self.page().next_cursor)
+        # 第 5、6 条（id 8、7）时间戳相同，只能靠 id 分开
+        self.assertEqual(self.ids_of(second), self.ids[5:10])
+        self.assertTrue(second.has_next)
+        self.assertTrue(second.has_prev)
+        third = self.page(second.next_cursor)
+        self.assertEqual(self.ids_of(third), self.ids[10:])
+        self.assertFalse(third.has_next)
+        self.assertIsNone(third.next_cursor)
+        self.assertTrue(third.has_prev)
+
+    def test_prev_page(self):
+        third = self.page(self.page(self.page().next_cursor).next_cursor)
+        second = self.page(third.prev_cursor)
+        self.assertEqual(self.ids_of(second), self.ids[5:10])
+        self.assertTrue(second.has_prev)
+        self.assertTrue(second.has_next)
+        first = self.page(second.prev_cursor)
+        self.assertEqual(self.ids_of(first), self.ids[:5])
+        self.assertFalse(first.has_prev)
+        self.assertTrue(first.has_next)
+
+    def test_last_page(self):
+        last = self.page(last=True)
+        self.assertEqual(self.ids_of(last), self.ids[-5:])
+        self.assertTrue(last.has_prev)
+        self.assertFalse(last.has_next)
+        self.assertEqual(self.ids_of(self.page(last.prev_cursor)), self.ids[2:7])
+
+    def test_ascending_and_count(self):
+        pagination = self.page(descending=False, count=True)
+        self.assertEqual(self.ids_of(pagination), list(range(1, 6)))
+        self.assertEqual(pagination.total, 12)
+        self.assertEqual(self.ids_of(self.page(pagination.next_cursor, descending=False)), list(range(6, 11)))
+
+    def test_bad_cursor_starts_over(self):
+        for cursor in ('garbage', self.page().next_cursor[:-4], encode_cursor([1]),
+                       encode_cursor(['not a date', 'not an id']), encode_cursor([datetime(2020, 1, 1), True])):
+            pagination = self.page(cursor)
+            self.assertEqual(self.ids_of(pagination), self.ids[:5])
+            self.assertFalse(pagination.has_prev)
@@ -0,0 +1,17 @@
+import sys
+import unittest
+
+from app.profiler import collapse, flamegraph
+
+
+class ProfilerTestCase(unittest.TestCase):
+    def test_collapse_is_outermost_first(self):
+        stack = collapse(sys._getframe())
+        self.assertTrue(stack.endswith(__name__ + '.test_collapse_is_outermost_first'))
+
+    def test_flamegraph(self):
+        svg = flamegraph('main.home;a;b 3\nmain.home;a;c 1\n', title='home')
+        self.assertTrue(svg.startswith('<svg'))
+        self.assertIn('home, 4 samples', svg)
+        self.assertIn('a (4 samples, 100.0%)', svg)
+        self.assertIn('b (3 samples, 75.0%)', svg)
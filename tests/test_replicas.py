@@ -0,0 +1,156 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from base64 import b64encode
+
+from flask import g, request
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+
+from app import create_app, db
+from app.cache import LRUCache
+from app.models import Role, User
+from app.presence import last_seen_buffer
+from app.replicas import ReplicaRouter, ping, pool_options, read_only, replica_router
+
+
+class ReplicaRouterTestCase(unittest.TestCase):
+    def test_read_only_marks_view(self):
+        @read_only
+        def view():
+            pass
+
+        self.assertTrue(view.read_only)
+
+    def test_pool_options(self):
+        config = {'DB_POOL_SIZE': 10, 'DB_MAX_OVERFLOW': 20, 'DB_POOL_RECYCLE': 3600, 'DB_POOL_TIMEOUT': 10}
+        self.assertEqual(pool_options(config), {'pool_size': 10, 'max_overflow': 20, 'pool_recycle': 3600,
+                                                'pool_timeout': 10})
+
+    def test_export_pool_gauges(self):
+        router = ReplicaRouter()
+        engine = create_engine('sqlite://', poolclass=QueuePool, pool_size=3)
+        router.engines_by_name = lambda: [('replica0', engine)]
+        connection = engine.connect()
+        router.routed.inc(('replica0',))
+        lines = router.export().splitlines()
+        connection.close()
+        self.assertIn('db_pool_connections{bind="replica0",state="size"} 3', lines)
+        self.assertIn('db_pool_connections{bind="replica0",state="checked_out"} 1', lines)
+        self.assertIn('db_replica_requests_total{replica="replica0"} 1', lines)
+
+
+def source():
+    return Role.query.filter(Role.name != 'written').first().name
+
+
+@read_only
+def read_view():
+    if request.args.get('user'):
+        g.current_user = User.query.get(1)
+    return source()
+
+
+def primary_view():
+    return source()
+
+
+@read_only
+def flush_view():
+    before = source()
+    db.session.add(Role(name='written'))
+    db.session.flush()
+    after = source()
+    db.session.rollback()
+    return '%s,%s' % (before, after)
+
+
+def write_view():
+    g.current_user = User.query.get(1)
+    db.session.add(Role(name='written'))
+    db.session.commit()
+    return 'ok'
+
+
+class RoutingTestCase(unittest.TestCase):
+    """A primary and a replica SQLite file that each hold one role named after the database"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.app = create_app()
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(self.dir, 'primary.sqlite')
+        self.app.config['SECRET_KEY'] = 'test'
+        self.app.add_url_rule('/read', 'read', read_view, methods=['GET', 'POST'])
+        self.app.add_url_rule('/primary', 'primary', primary_view)
+        self.app.add_url_rule('/flush', 'flush', flush_view)
+        self.app.add_url_rule('/write', 'write', write_view, methods=['POST'])
+        replica = create_engine('sqlite:///' + os.path.join(self.dir, 'replica.sqlite'))
+        self.saved = (replica_router.engines, replica_router.sticky, replica_router.recent_writers,
+                      replica_router.pre_ping)
+        replica_router.engines = [replica]
+        replica_router.sticky = 0.5
+        replica_router.recent_writers = LRUCache(ttl=0.5)
+        with self.app.app_context():
+            for engine in (db.engine, replica):
+                db.metadata.create_all(engine)
+                name = 'primary' if engine is db.engine else 'replica'
+                engine.execute(Role.__table__.insert(), id=1, name=name, permissions=0xff)
+                engine.execute(User.__table__.insert(), id=1, email='a@example.com', username=name,
+                               confirmed=True, role_id=1)
+            self.token = User.query.get(1).generate_auth_token()
+
+    def tearDown(self):
+        # token 认证会 ping，把缓冲的 last_seen 写进即将删除的库
+        last_seen_buffer.flush()
+        (replica_router.engines, replica_router.sticky, replica_router.recent_writers,
+         replica_router.pre_ping) = self.saved
+        shutil.rmtree(self.dir)
+
+    def get(self, client, path):
+        return client.get(path).get_data(as_text=True)
+
+    def test_read_only_get_uses_replica(self):
+        self.assertEqual(self.get(self.app.test_client(), '/read'), 'replica')
+
+    def test_post_and_unmarked_views_use_primary(self):
+        client = self.app.test_client()
+        self.assertEqual(client.post('/read').get_data(as_text=True), 'primary')
+        self.assertEqual(self.get(client, '/primary'), 'primary')
+
+    def test_flush_moves_rest_of_request_to_primary(self):
+        self.assertEqual(self.get(self.app.test_client(), '/flush'), 'replica,primary')
+
+    def test_commit_sticks_session_and_user_to_primary(self):
+        writer = self.app.test_client()
+        writer.post('/write')
+        # 同一个浏览器会话（cookie）和同一个 API 用户在粘滞窗口内读主库
+        self.assertEqual(self.get(writer, '/read'), 'primary')
+        self.assertEqual(self.get(self.app.test_client(), '/read?user=1'), 'primary')
+        self.assertEqual(self.get(self.app.test_client(), '/read'), 'replica')
+        time.sleep(0.6)
+        self.assertEqual(self.get(writer, '/read'), 'replica')
+        self.assertEqual(self.get(self.app.test_client(), '/read?user=1'), 'replica')
+
+    def test_token_user_sticks_to_primary(self):
+        # token 认证的 g.current_user 是 Identity 而不是 User
+        headers = {'Authorization': 'Basic ' + b64encode((self.token + ':').encode('utf-8')).decode('ascii')}
+
+        def read(client):
+            return client.get('/api/1.0/user/1', headers=headers).get_json()['username']
+
+        self.assertEqual(read(self.app.test_client()), 'replica')
+        response = self.app.test_client().post('/api/1.0/posts/', json={'body': 'hello'}, headers=headers)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(read(self.app.test_client()), 'primary')
+        time.sleep(0.6)
+        self.assertEqual(read(self.app.test_client()), 'replica')
+
+    def test_pre_ping_only_on_app_pools(self):
+        replica_router.pre_ping = True
+        client = self.app.test_client()
+        self.get(client, '/read')
+        with self.app.app_context():
+            self.assertTrue(ping in db.engine.pool.dispatch.checkout)
+        self.assertFalse(ping in create_engine('sqlite://').pool.dispatch.checkout)
@@ -0,0 +1,27 @@
+import unittest
+
+from app.search import tokenize, term_weights, query_terms
+
+
+class TokenizeTestCase(unittest.TestCase):
+    def test_latin_words(self):
+        self.assertEqual(tokenize('Hello, Flask_SQLAlchemy 2.0!'), ['hello', 'flask', 'sqlalchemy', '2', '0'])
+
+    def test_cjk_unigrams_and_bigrams(self):
+        self.assertEqual(tokenize('你好世界'), ['你', '好', '世', '界', '你好', '好世', '世界'])
+        self.assertEqual(tokenize('用python写'), ['用', 'python', '写'])
+
+    def test_query_uses_bigrams(self):
+        self.assertEqual(query_terms('天气 天'), ['天', '天气'])
+
+    def test_weights_normalized_by_length(self):
+        weights = term_weights('a a b c')
+        self.assertAlmostEqual(weights['a'], 1.0)
+        self.assertAlmostEqual(weights['b'], 0.5)
+        self.assertEqual(term_weights(''), {})
+
+    def test_accents_and_width_are_folded(self):
+        # MySQL 默认排序规则下相等的写法必须是同一个词，否则同一篇帖子会撞主键
+        self.assertEqual(tokenize('Café cafe ＣＡＦＥ naïve'), ['cafe', 'cafe', 'cafe', 'naive'])
+        self.assertEqual(list(term_weights('café cafe')), ['cafe'])
+        self.assertEqual(query_terms('CAFÉ'), ['cafe'])
@@ -0,0 +1,95 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from datetime import datetime
+
+from app import create_app, db
+from app.models import Role
+from app.seed import Seeder
+from app.snapshot import MANIFEST, SNAPSHOT_TABLES, Snapshot, encode, parse_datetime
+
+
+class SnapshotEncodingTestCase(unittest.TestCase):
+    def test_datetimes_round_trip(self):
+        for value in (datetime(2020, 5, 17, 8, 30, 1), datetime(2020, 5, 17, 8, 30, 1, 250)):
+            self.assertEqual(parse_datetime(json.loads(json.dumps(value, default=encode))), value)
+
+    def test_unknown_types_are_rejected(self):
+        with self.assertRaises(TypeError):
+            json.dumps({'value': object()}, default=encode)
+
+
+class SnapshotRoundTripTestCase(unittest.TestCase):
+    """Export a small seeded SQLite database and import it into an empty one"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.snapshot_dir = os.path.join(self.dir, 'snapshot')
+        self.source = self.app('source.sqlite')
+        self.target = self.app('target.sqlite')
+        with self.source.app_context(), redirect_stdout(io.StringIO()):
+            db.create_all()
+            Role.insert_roles()
+            Seeder(users=30, follows=3, posts=40, comments=30, chunk_size=7).run(index=False)
+            # 角色 id 在两个库里不同，导入时要按名字对应
+            db.engine.execute(Role.__table__.update().values(id=Role.id + 10))
+            db.engine.execute("UPDATE users SET role_id = role_id + 10")
+            self.manifest = Snapshot(self.snapshot_dir, chunk_rows=16, batch_size=5).export()
+            self.rows = self.dump()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def app(self, name):
+        app = create_app()
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(self.dir, name)
+        return app
+
+    def dump(self):
+        """Rows of the snapshot tables by table name, with role names in place of role ids"""
+        roles = {role.id: role.name for role in Role.query}
+        rows = {}
+        for name in SNAPSHOT_TABLES:
+            table = db.metadata.tables[name]
+            rows[name] = [dict(row) for row in db.engine.execute(
+                table.select().order_by(*table.primary_key.columns))]
+        for row in rows['users']:
+            row['role_id'] = roles[row['role_id']]
+        return rows
+
+    def load(self):
+        with self.target.app_context(), redirect_stdout(io.StringIO()):
+            db.create_all()
+            Snapshot(self.snapshot_dir, batch_size=5).load(index=False)
+            return self.dump()
+
+    def test_rows_ids_and_roles_survive(self):
+        self.assertEqual(self.load(), self.rows)
+
+    def test_tables_are_split_into_chunks(self):
+        for name in SNAPSHOT_TABLES:
+            files = self.manifest['tables'][name]
+            self.assertEqual(sum(entry['rows'] for entry in files), len(self.rows[name]))
+            self.assertEqual(len(files), -(-len(self.rows[name]) // 16))
+            for entry in files:
+                self.assertTrue(os.path.exists(os.path.join(self.snapshot_dir, entry['file'])))
+
+    def test_refuses_non_empty_database(self):
+        self.load()
+        with self.target.app_context():
+            with self.assertRaises(RuntimeError):
+                Snapshot(self.snapshot_dir).load(index=False)
+
+    def test_manifest_row_count_is_checked(self):
+        path = os.path.join(self.snapshot_dir, MANIFEST)
+        with open(path) as f:
+            manifest = json.load(f)
+        manifest['tables']['posts'][0]['rows'] += 1
+        with open(path, 'w') as f:
+            json.dump(manifest, f)
+        with self.assertRaises(RuntimeError):
+            self.load()
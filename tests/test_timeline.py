@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from app import create_app, db
+from app.models import Post, Role, Timeline, User
+from app.pagination import MergedKeysetPagination, decode_cursor
+from app.presence import last_seen_buffer
+
+
+class TimelineTestCase(unittest.TestCase):
+    """u0 follows a fan-out author and a hot author whose posts are merged at read time"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.app = create_app()
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(self.dir, 'data.sqlite')
+        self.app.config['TIMELINE_FANOUT_LIMIT'] = 3
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.users = [User(email='u%d@example.com' % i, username='u%d' % i, password='x') for i in range(4)]
+        db.session.add_all(self.users)
+        db.session.commit()
+        reader, author, hot, fan = self.users
+        fan.follow(hot)
+        reader.follow(author)
+        reader.follow(hot)
+        start = datetime(2020, 1, 1)
+        # 每三篇同一时间戳，翻页要靠 id 区分
+        for i in range(20):
+            db.session.add(Post(body='p%d' % i, author=hot if i % 2 else author,
+                                timestamp=start + timedelta(minutes=i // 3)))
+        db.session.add(Post(body='not followed', author=fan, timestamp=start))
+        db.session.commit()
+
+    def tearDown(self):
+        last_seen_buffer.flush()
+        db.session.remove()
+        self.context.pop()
+        shutil.rmtree(self.dir)
+
+    def pages(self, user, size, cursor=None):
+        return MergedKeysetPagination(Timeline.branches(user), cursor=cursor, per_page=size,
+                                      key=Timeline.post_key, load=Timeline.load_posts)
+
+    def expected(self):
+        return [post.id for post in Post.query.filter(Post.author_id.in_([self.users[1].id, self.users[2].id]))
+                .order_by(Post.timestamp.desc(), Post.id.desc())]
+
+    def test_hot_author_is_merged_at_read_time(self):
+        reader, author, hot, fan = self.users
+        self.assertTrue(hot.fanout_on_read)
+        self.assertFalse(author.fanout_on_read)
+        self.assertEqual(len(Timeline.branches(reader)), 2)
+        self.assertEqual(Timeline.query.filter_by(user_id=reader.id, author_id=hot.id).count(), 0)
+
+    def test_pages_cover_timeline_in_order(self):
+        ids = []
+        cursor = None
+        while True:
+            pagination = self.pages(self.users[0], 4, cursor)
+            ids.extend(post.id for post in pagination.items)
+            if not pagination.has_next:
+                break
+            cursor = pagination.next_cursor
+        self.assertEqual(ids, self.expected())
+        previous = self.pages(self.users[0], 4, pagination.prev_cursor)
+        self.assertEqual([post.id for post in previous.items], self.expected()[-8:-4])
+        self.assertEqual(decode_cursor(pagination.prev_cursor)[0], Timeline.post_key(pagination.items[0]))
+
+    def test_duplicate_keys_are_kept_once(self):
+        reader, author, hot, fan = self.users
+        # 成为大V之前写扩散的行仍留在 timeline 里
+        post = hot.posts.first()
+        db.session.add(Timeline(user_id=reader.id, post_id=post.id, author_id=hot.id, timestamp=post.timestamp))
+        db.session.commit()
+        pagination = self.pages(reader, 100)
+        self.assertEqual([post.id for post in pagination.items], self.expected())
+
+    def test_count_is_distinct(self):
+        pagination = MergedKeysetPagination(Timeline.branches(self.users[0]), per_page=4, count=True,
+                                            key=Timeline.post_key, load=Timeline.load_posts)
+        self.assertEqual(pagination.total, 20)
+
+    def test_branches_are_index_range_scans(self):
+        for query, columns in Timeline.branches(self.users[0]):
+            page = MergedKeysetPagination.page(query, columns, [datetime(2020, 1, 1, 0, 3), 10], True).limit(5)
+            sql = str(page.statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+            plan = ' '.join(row[-1] for row in db.engine.execute('EXPLAIN QUERY PLAN ' + sql))
+            self.assertIn('INDEX', plan)
+            self.assertNotIn('TEMP B-TREE', plan)